@@ -0,0 +1,209 @@
+"""
+Benchmark suite for the stages of an ECU run
+
+every input is synthesized locally in a temporary directory: a silent WAVE file and an empty mp3 of
+--audio-length seconds and tracklists of each --rows size, then probe_duration, parse_tracklist_csv, write_cue,
+split_tracks and the mp3 frame index are timed separately, the best and mean of --repeat runs are reported
+
+usage: python bench.py [--rows 10 100 1000 10000 100000] [--output results.json] [--compare baseline.json]
+
+results are written as json so runs from different releases can be compared, --compare exits with status 1
+if any benchmark got more than --threshold times slower than the baseline
+the ffmpeg split engines are skipped when ffmpeg isn't installed
+"""
+import sys
+import os
+import io
+import csv
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ecu
+
+
+def make_wav(audio_file_path, seconds, sample_rate=44100):
+    """Writes a silent 16 bit stereo WAVE file of seconds length, a second at a time"""
+
+    with wave.open(audio_file_path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        one_second = b'\0' * 4 * sample_rate
+        for i in range(seconds):
+            w.writeframes(one_second)
+
+
+def make_mp3(audio_file_path, seconds):
+    """Writes a 128kbps 44.1kHz CBR mp3 of seconds length, every frame is a valid header and an empty payload"""
+
+    # MPEG 1 layer III, 128kbps, 44.1kHz, no padding, which makes every frame 417 bytes
+    frame = b'\xff\xfb\x90\x00' + b'\0' * 413
+    with open(audio_file_path, 'wb') as f:
+        f.write(frame * int(seconds * 44100 / 1152))
+
+
+def make_tracklist(tracklist_path, rows, track_length=1):
+    """Writes a tracklist.csv of rows tracks, each track_length seconds long"""
+
+    with open(tracklist_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(rows):
+            writer.writerow([str(i + 1), 'Artist ' + str(i % 97), 'Title ' + str(i + 1), ecu.get_hms(i * track_length)])
+
+
+def time_function(function, repeat, setup=None):
+    """Runs function repeat times, returns a list of wall times in seconds, setup runs untimed before each run"""
+
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def result(benchmark, timings, **parameters):
+    """Builds a single machine readable benchmark result"""
+
+    entry = {'benchmark': benchmark, 'best': min(timings), 'mean': sum(timings) / len(timings),
+             'repeat': len(timings)}
+    entry.update(parameters)
+    return entry
+
+
+def run_benchmarks(directory, rows_sizes, audio_length, split_rows, repeat):
+    """Synthesizes the inputs in directory and returns a list of benchmark results"""
+
+    results = []
+    devnull = open(os.devnull, 'w')
+
+    audio_file_path = directory + '/synthetic.wav'
+    make_wav(audio_file_path, audio_length)
+    results.append(result('probe_duration', time_function(
+        lambda: ecu.probe_duration(audio_file_path, use_cache=False), repeat), audio_length=audio_length))
+
+    for rows in rows_sizes:
+        tracklist_path = directory + '/tracklist ' + str(rows) + '.csv'
+        make_tracklist(tracklist_path, rows)
+        results.append(result('parse_tracklist_csv', time_function(
+            lambda: ecu.parse_tracklist_csv(tracklist_path, rows), repeat), rows=rows))
+
+        album = ecu.Album(audio_file_path, tracklist_path, total_duration_seconds=rows)
+        album.album_performer = 'Various Artists'
+
+        def write_cue():
+            with contextlib.redirect_stdout(devnull):
+                ecu.write_cue(album, 'synthetic.cue')
+
+        results.append(result('write_cue', time_function(write_cue, repeat), rows=rows))
+        results.append(result('write_cue_to', time_function(
+            lambda: ecu.write_cue_to(album, io.StringIO()), repeat), rows=rows))
+
+        # a now-playing service asks about many timestamps across the whole file at once
+        track_index = ecu.TrackIndex.from_album(album)
+        timestamps = [rows * i / 100000.0 for i in range(100000)]
+        results.append(result('track_index_lookup', time_function(
+            lambda: track_index.lookup(timestamps), repeat), rows=rows, timestamps=len(timestamps)))
+
+    tracklist_path = directory + '/tracklist.csv'
+    make_tracklist(tracklist_path, split_rows, track_length=audio_length // split_rows)
+    album = ecu.Album(audio_file_path, tracklist_path)
+
+    for engine in ecu.SPLIT_ENGINES:
+        # the synthetic file is a WAVE, so only the ffmpeg engines need ffmpeg
+        if engine in ('segment', 'per-track') and not shutil.which('ffmpeg'):
+            print('ffmpeg not found, skipping split_tracks ' + engine, file=sys.stderr)
+            continue
+
+        def clear_split():
+            if os.path.exists(directory + '/split'):
+                shutil.rmtree(directory + '/split')
+
+        def split():
+            with contextlib.redirect_stdout(devnull):
+                ecu.split_tracks(album, engine=engine)
+
+        results.append(result('split_tracks', time_function(split, repeat, setup=clear_split),
+                              rows=split_rows, audio_length=audio_length, engine=engine))
+
+    # the mp3 engine cost is the frame scan, the copies are the same as for PCM
+    mp3_file_path = directory + '/synthetic.mp3'
+    make_mp3(mp3_file_path, audio_length)
+    with open(mp3_file_path, 'rb') as f:
+        mp3_data = f.read()
+    results.append(result('build_mp3_frame_index', time_function(
+        lambda: ecu.build_mp3_frame_index(mp3_data), repeat), audio_length=audio_length))
+
+    album = ecu.Album(mp3_file_path, tracklist_path, total_duration_seconds=audio_length)
+
+    def split_mp3():
+        ecu.split_tracks(album, engine='native')
+
+    results.append(result('split_tracks_mp3', time_function(split_mp3, repeat, setup=clear_split),
+                          rows=split_rows, audio_length=audio_length, engine='native'))
+
+    devnull.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints every benchmark that is more than threshold times slower than baseline, returns how many there were"""
+
+    def key(entry):
+        return tuple(sorted((k, v) for k, v in entry.items() if k not in ('best', 'mean', 'repeat')))
+
+    baseline_best = dict((key(entry), entry['best']) for entry in baseline['results'])
+    regressions = 0
+    for entry in results:
+        previous_best = baseline_best.get(key(entry))
+        if previous_best and entry['best'] > previous_best * threshold:
+            regressions += 1
+            print('REGRESSION {}: {:.6f}s, was {:.6f}s'.format(dict(key(entry)), entry['best'], previous_best))
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='tracklist sizes for parse_tracklist_csv and write_cue')
+    parser.add_argument('--audio-length', type=int, default=600, help='length of the synthetic WAVE file in seconds')
+    parser.add_argument('--split-rows', type=int, default=10, help='number of tracks split_tracks cuts')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of each benchmark')
+    parser.add_argument('-o', '--output', help='write the json results here instead of stdout')
+    parser.add_argument('--compare', help='json results of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown factor counted as a regression')
+    pargs = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = run_benchmarks(directory, pargs.rows, pargs.audio_length, pargs.split_rows, pargs.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'numpy': ecu.numpy is not None, 'results': results}
+    if pargs.output:
+        with open(pargs.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print('')
+
+    if pargs.compare:
+        with open(pargs.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, pargs.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,76 @@
+"""
+Compares the wall time of the split engines on a synthetic album
+
+a sine wave mp3 is generated with ffmpeg and cut into evenly sized tracks, then split with
+the original track by track loop (one ffmpeg at a time), the parallel per-track engine and the
+single pass segment engine
+
+usage: python split_engines.py [--tracks 100] [--track-length 30]
+
+ffmpeg and ffprobe are prerequisites, everything is written to a temporary directory
+"""
+import sys
+import os
+import csv
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ecu
+
+
+def make_album(directory, tracks, track_length):
+    """Writes a synthetic mp3 and matching tracklist.csv to directory, returns the audio file path"""
+
+    audio_file_path = directory + '/synthetic.mp3'
+    total_length = tracks * track_length
+    subprocess.run(['ffmpeg', '-v', 'quiet', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=' + str(total_length),
+                    '-c:a', 'libmp3lame', '-b:a', '192k', '-y', audio_file_path], check=True)
+
+    with open(directory + '/tracklist.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(tracks):
+            writer.writerow([str(i + 1), 'Artist', 'Title ' + str(i + 1), ecu.get_hms(i * track_length)])
+
+    return audio_file_path
+
+
+def time_split(album, jobs, engine):
+    """Splits album into a fresh split directory, returns the wall time in seconds"""
+
+    split_output_directory = album.audio_file_directory + '/split'
+    if os.path.exists(split_output_directory):
+        shutil.rmtree(split_output_directory)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        ecu.split_tracks(album, jobs=jobs, engine=engine)
+    return time.perf_counter() - start
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=100, help='number of tracks in the synthetic album')
+    parser.add_argument('--track-length', type=int, default=30, help='length of each track in seconds')
+    pargs = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp()
+    try:
+        album = ecu.Album(make_album(directory, pargs.tracks, pargs.track_length))
+        results = [('per-track loop, 1 job', time_split(album, 1, 'per-track')),
+                   ('per-track, ' + str(os.cpu_count()) + ' jobs', time_split(album, None, 'per-track')),
+                   ('segment, single pass', time_split(album, None, 'segment'))]
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} tracks of {}'.format(pargs.tracks, ecu.get_hms(pargs.track_length)))
+    for name, seconds in results:
+        print('{:<30}{:>10.2f}s'.format(name, seconds))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+"""
+Compares calling get_seconds / get_hms once per value against the bulk conversions
+
+usage: python time_conversion.py [--count 100000] [--repeat 5]
+
+the bulk conversions use numpy when it is installed, --no-numpy times the pure python path instead
+"""
+import sys
+import os
+import random
+import timeit
+import argparse
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ecu
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000, help='number of timestamps converted')
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many runs is reported')
+    parser.add_argument('--no-numpy', action='store_true', help='time the pure python bulk path')
+    pargs = parser.parse_args(args)
+
+    random.seed(0)
+    seconds_values = [random.randrange(0, 36000) for i in range(pargs.count)]
+    hms_values = [ecu.get_hms(seconds) for seconds in seconds_values]
+
+    with unittest.mock.patch('ecu.numpy', None if pargs.no_numpy else ecu.numpy):
+        results = [
+            ('get_seconds per call', lambda: [ecu.get_seconds(hms) for hms in hms_values]),
+            ('get_seconds_bulk', lambda: ecu.get_seconds_bulk(hms_values)),
+            ('get_hms per call', lambda: [ecu.get_hms(seconds) for seconds in seconds_values]),
+            ('get_hms_bulk', lambda: ecu.get_hms_bulk(seconds_values)),
+        ]
+        timings = [(name, min(timeit.repeat(function, number=1, repeat=pargs.repeat))) for name, function in results]
+
+    print('{} timestamps, bulk path uses {}'.format(pargs.count, 'numpy' if ecu.numpy and not pargs.no_numpy
+                                                   else 'pure python'))
+    for name, seconds in timings:
+        print('{:<25}{:>10.4f}s'.format(name, seconds))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
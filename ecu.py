@@ -8,10 +8,13 @@ get_seconds(hms) converts a HH:MM:SS string to a seconds int
 
 get_hms(seconds) converts a number of seconds to an HH:MM:SS string
 
+get_seconds_bulk(hms_values) and get_hms_bulk(seconds_values) convert whole columns at once
+
 generate() runs the bulk of the program, it expects at least 1 argument of the path to audio file.
 tracklist_path and verbose are optional.
 
-external programs ffmpeg and ffprobe are prerequisites for this module to run
+external programs ffmpeg and ffprobe are prerequisites for this module to run,
+WAVE, AIFF and mp3 durations are read without ffprobe
 """
 import sys
 import csv
@@ -19,6 +22,232 @@ import os.path
 import subprocess
 import argparse
 import re
+import concurrent.futures
+import contextlib
+import json
+import io
+import shutil
+import time
+import tempfile
+import struct
+import mmap
+import itertools
+import threading
+import functools
+import cProfile
+import tracemalloc
+import asyncio
+import array
+import hashlib
+import copy
+import math
+import operator
+import socket
+import socketserver
+import zlib
+import bisect
+import zipfile
+import tarfile
+import sqlite3
+import atexit
+
+# numpy is optional, the bulk time conversions use it when it is installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# inotify_simple is optional, watch mode polls the drop directories without it
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# fcntl is only on unix, elsewhere processes sharing the duration cache can drop each other's entries
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ways split_tracks can cut an album, the first one is the default
+SPLIT_ENGINES = ('auto', 'native', 'segment', 'per-track')
+
+# WAVE format tags and AIFF-C compression types whose audio is plain frames that can be cut on any frame boundary
+PCM_WAVE_FORMATS = (1, 3, 0xFFFE)
+PCM_AIFC_COMPRESSIONS = (b'NONE', b'sowt', b'twos', b'raw ', b'fl32', b'fl64')
+
+# size of each write when PCM has to be copied out of the memory map by hand
+COPY_CHUNK_SIZE = 1 << 20
+
+# os.open needs to be told not to translate newlines on Windows
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+# seconds a track may run past the last indexed mp3 frame, a few frames lost to damage are tolerated
+MP3_INDEX_TOLERANCE = 0.1
+
+# cached mp3 frame indexes kept, the least recently used go first
+MP3_INDEX_MAX_FILES = 1000
+
+# mp3 frame indexes a process keeps in memory after using them, the least recently used go first
+MP3_INDEX_MEMORY_FILES = 16
+
+# an mp3 without a Xing/Info or VBRI header whose first this many frames share a bitrate is taken to be CBR
+MP3_CBR_FRAMES = 32
+
+# header of a cached mp3 frame index: magic, source size, source mtime_ns, sample rate, samples per frame, frames
+MP3_INDEX_MAGIC = b'ECUI2'
+MP3_INDEX_HEADER = struct.Struct('<QqIIQ')
+
+# header of a saved TrackIndex: magic, total duration (nan if unknown), tracks, length of the json track names
+TRACK_INDEX_MAGIC = b'ECUT1'
+TRACK_INDEX_HEADER = struct.Struct('<dQQ')
+
+# output formats of transcode mode, each a tuple of (extension, ffmpeg encoder arguments)
+TRANSCODE_PRESETS = {
+    'flac': ('.flac', ['-c:a', 'flac', '-compression_level', '8']),
+    'mp3': ('.mp3', ['-c:a', 'libmp3lame', '-q:a', '0']),
+    'opus': ('.opus', ['-c:a', 'libopus', '-b:a', '160k']),
+    'wav': ('.wav', ['-c:a', 'pcm_s16le']),
+}
+
+# each ffmpeg instance of transcode mode writes at most this many files, every one an open file and a run of arguments
+TRANSCODE_MAX_OUTPUTS = 64
+
+# kept in the split output directory, records what every split track was cut from
+SPLIT_MANIFEST_NAME = '.ecu-manifest.json'
+
+# archive mode containers and the engines that can feed them
+ARCHIVE_FORMATS = ('zip', 'tar')
+ARCHIVE_ENGINES = ('auto', 'native', 'ffmpeg')
+
+# an abandoned tar stream ends in a header of this name whose data never follows, so readers report it truncated
+ARCHIVE_INCOMPLETE_NAME = 'INCOMPLETE'
+
+# ffmpeg muxer arguments that stream a stream copied track of each source format to a pipe
+PIPE_MUXERS = {
+    '.mp3': ['-f', 'mp3'],
+    '.wav': ['-f', 'wav'],
+    '.aiff': ['-f', 'aiff'],
+    '.aif': ['-f', 'aiff'],
+    '.flac': ['-f', 'flac'],
+    '.m4a': ['-f', 'ipod', '-movflags', 'frag_keyframe+empty_moov'],
+    '.ogg': ['-f', 'ogg'],
+    '.opus': ['-f', 'opus'],
+    '.wma': ['-f', 'asf'],
+}
+
+# a tar header needs the member size up front, piped tracks are held in memory up to this size before spilling
+ARCHIVE_SPOOL_SIZE = 64 << 20
+
+# tables of the library catalog, paths are absolute, an album that was only imported has processed NULL
+CATALOG_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS albums (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    tracklist_path TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    tracklist_size INTEGER,
+    tracklist_mtime_ns INTEGER,
+    duration REAL,
+    cue_extension TEXT,
+    cue_path TEXT,
+    split INTEGER NOT NULL DEFAULT 0,
+    processed REAL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    album_id INTEGER NOT NULL REFERENCES albums (id) ON DELETE CASCADE,
+    number TEXT,
+    artist TEXT,
+    title TEXT,
+    start REAL,
+    length REAL,
+    output_path TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album_id);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_title ON tracks (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_output_path ON tracks (output_path);
+'''
+
+# queue mode leases, a worker that hasn't sent a heartbeat for this many seconds is presumed dead
+QUEUE_LEASE_SECONDS = 60.0
+QUEUE_POLL_INTERVAL = 2.0
+QUEUE_MAX_ATTEMPTS = 3
+
+# the queue is one table, jobs are claimed oldest first among the pending ones and the expired leases
+QUEUE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    audio TEXT NOT NULL,
+    tracklist TEXT,
+    track TEXT,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    result TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+'''
+
+# written to the split output directory by verify mode
+VERIFY_REPORT_NAME = '.ecu-verify.json'
+
+# seconds a split track's duration may differ from its tracklist length, a little over a frame of any codec
+VERIFY_TOLERANCE = 0.1
+
+# verify mode statuses that fail an album, 'unknown' only means the duration couldn't be read
+VERIFY_FAILURES = ('missing', 'empty', 'corrupt', 'duration')
+
+# filename prefix of tracks being renamed, so swapped filenames don't overwrite each other
+RENAME_PREFIX = '.ecu-rename-'
+
+# how often watch mode checks on albums being processed, in seconds
+WATCH_BUSY_INTERVAL = 0.5
+
+# filename prefix of the segment engine's output before the segments are renamed to their tracks
+SEGMENT_PREFIX = '.ecu-segment-'
+
+# this regex format is a bit more lenient than documentation states, but it shouldn't cause issues
+HMS_FORMAT = re.compile('^([0-9]+:){0,2}([0-9]+)$')
+
+# translation table that strips the digits out of a column of HH:MM:SS values, leaving just the separators
+HMS_DIGITS = str.maketrans('', '', '0123456789')
+HMS_SECONDS_ONLY = re.compile('^([0-9]+)$', re.MULTILINE)
+HMS_MINUTES_ONLY = re.compile('^([0-9]+:[0-9]+)$', re.MULTILINE)
+
+# int value of every one and two digit HH:MM:SS field
+HMS_FIELD_VALUES = dict([(str(value), value) for value in range(100)] + [('0' + str(value), value) for value in range(10)])
+
+# get_hms output for every value under an hour, with and without zero padded minutes
+HMS_TABLE = ['%d:%02d' % divmod(seconds, 60) for seconds in range(3600)]
+HMS_PADDED_TABLE = ['%02d:%02d' % divmod(seconds, 60) for seconds in range(3600)]
+
+# how many tracklist rows are read before their indexes are converted together
+TRACKLIST_CHUNK_ROWS = 1024
+
+# detect mode measures loudness in windows of DETECT_WINDOW_SECONDS, a track boundary is the middle of at least
+# DETECT_MIN_SILENCE seconds below DETECT_THRESHOLD_DB dBFS, no closer than DETECT_MIN_TRACK_LENGTH to the last one
+DETECT_WINDOW_SECONDS = 0.05
+DETECT_THRESHOLD_DB = -50.0
+DETECT_MIN_SILENCE = 1.5
+DETECT_MIN_TRACK_LENGTH = 30.0
+
+# formats ffmpeg has to decode are analysed as mono 16 bit audio at this rate, which is plenty for loudness
+DETECT_SAMPLE_RATE = 22050
+
+# without numpy only this many samples of each window are measured
+DETECT_FALLBACK_WINDOW_SAMPLES = 256
+
+# extensions batch mode treats as album audio files when searching a directory tree
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.aiff', '.aif', '.flac', '.m4a', '.ogg', '.opus', '.wma')
 
 
 class Album(object):
@@ -26,9 +255,14 @@ class Album(object):
     This class contains the tracklist and other album information relevant to building cue files and splitting
     the __init__ constructor requires a string containing the path to the audio file, the tracklist path is optional
     if no tracklist path is provided, it will be assumed that tracklist.csv exists in the same director as the audio
+    total_duration_seconds is optional, when it is already known the audio file isn't probed again
+    use_cache=False skips the duration cache when probing, see probe_duration
+
+    nothing is read until it is needed, the tracklist on first use of tracks or tracklist_data and the duration on
+    first use of total_duration_seconds, so writing a cue file, which only needs tracks, never probes the audio
     """
 
-    def __init__(self, audio_file_path, tracklist_path=None):
+    def __init__(self, audio_file_path, tracklist_path=None, total_duration_seconds=None, use_cache=True):
 
         # TODO do I need validation? or will standard errors be good enough?
         self.audio_file_path = audio_file_path
@@ -36,7 +270,9 @@ class Album(object):
         self.audio_file_name = os.path.basename(audio_file_path)
         self.audio_file_extension = os.path.splitext(self.audio_file_name)[1]
         self.album_title = os.path.splitext(self.audio_file_name)[0]
-        self.total_duration_seconds = probe_duration(audio_file_path)
+        self.use_cache = use_cache
+        self._total_duration_seconds = total_duration_seconds
+        self._tracks = None
         self.album_performer = ''
 
         # WAVE, MP3, and AIFF are the only "Supported" formats of cue files
@@ -52,7 +288,55 @@ class Album(object):
         else:
             self.tracklist_path = tracklist_path
 
-        self.tracklist_data = parse_tracklist_csv(self.tracklist_path, self.total_duration_seconds)
+    @property
+    def duration_known(self):
+        """Checks whether total_duration_seconds can be read without probing the audio file"""
+
+        return self._total_duration_seconds is not None
+
+    @property
+    def total_duration_seconds(self):
+        """Length of the audio file in seconds, probed on first use"""
+
+        if self._total_duration_seconds is None:
+            self.total_duration_seconds = probe_duration(self.audio_file_path, use_cache=self.use_cache)
+        return self._total_duration_seconds
+
+    @total_duration_seconds.setter
+    def total_duration_seconds(self, total_duration_seconds):
+
+        self._total_duration_seconds = total_duration_seconds
+        if self._tracks and total_duration_seconds is not None:
+            self._tracks[-1].length = total_duration_seconds - self._tracks[-1].index
+
+    @property
+    def tracks(self):
+        """The list of Track, parsed on first use, the last track's length is None until the duration is known"""
+
+        if self._tracks is None:
+            self._tracks = parse_tracklist_csv(self.tracklist_path, self._total_duration_seconds)
+        return self._tracks
+
+    @property
+    def tracklist_data(self):
+        """The list of Track with every length filled in, which probes the audio file for the last track's length"""
+
+        tracks = self.tracks
+        if tracks and tracks[-1].length is None:
+            tracks[-1].length = self.total_duration_seconds - tracks[-1].index
+        return tracks
+
+    @tracklist_data.setter
+    def tracklist_data(self, tracks):
+
+        self._tracks = tracks
+
+    def load_tracks(self, probe=False):
+        """Parses the tracklist now rather than on first use, probe=True also probes the audio file for its length"""
+
+        if probe:
+            return self.tracklist_data
+        return self.tracks
 
 
 def get_seconds(hms):
@@ -62,9 +346,7 @@ def get_seconds(hms):
 
     if type(hms) == str:
 
-        # this regex format is a bit more lenient than documentation states, but it shouldn't cause issues
-        str_format = re.compile('^([0-9]+:){0,2}([0-9]+)$')
-        validity = str_format.match(hms)
+        validity = HMS_FORMAT.match(hms)
         split_string = hms.split(':')
 
         if len(split_string) == 1 and validity:
@@ -119,228 +401,4252 @@ def get_hms(seconds, hours=True):
     return hms
 
 
-def probe_duration(audio_file_path):
-    """This uses ffprobe to find an audio file's length and returns seconds as a float"""
+class Metrics(object):
+    """
+    Collects per stage and per track timings, subprocess counts and bytes written during a run
 
-    # ffprobe utility can provide total duration of media file in seconds.
-    ffprobe_cmd = 'ffprobe -i "' + audio_file_path + '" -show_entries format=duration -v quiet -of csv="p=0"'
-    ffprobe_result = subprocess.Popen(ffprobe_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    total_duration_seconds = ffprobe_result.communicate()[0].decode(encoding='utf-8')
+    a track's cpu is the cpu time of the thread that handled it, ffmpeg's own cpu time only shows up per stage,
+    as child_cpu, since the instances of a stage run side by side and are reaped by subprocess
+    nothing is recorded until enable() is called, report() returns everything as a json friendly dict
+    hooks are called as hook(event, data) for every 'stage', 'track' and 'subprocess' event as it happens
+    """
 
-    # Stripping line and carriage returns from total_duration_seconds result and converting to float for later use
-    total_duration_seconds = total_duration_seconds.replace('\r', '')
-    total_duration_seconds = total_duration_seconds.replace('\n', '')
-    total_duration_seconds = float(total_duration_seconds)
-    return total_duration_seconds
+    def __init__(self):
 
+        self.enabled = False
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.reset()
 
-def parse_tracklist_csv(tracklist_path, total_duration_seconds):
+    def reset(self):
+        """Forgets everything recorded so far"""
+
+        self.stages = []
+        self.tracks = []
+        self.subprocesses = 0
+        self.bytes_written = 0
+        self.started = time.perf_counter()
+
+    def enable(self):
+        """Starts recording"""
+
+        self.enabled = True
+        self.reset()
+
+    def add_hook(self, hook):
+        """Registers hook(event, data) to be called for every event recorded"""
+
+        self.hooks.append(hook)
+
+    def emit(self, event, data):
+        for hook in self.hooks:
+            hook(event, data)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that records the wall and cpu time of the code it wraps as stage name"""
+
+        if not self.enabled:
+            yield
+            return
+
+        # cpu time of ffmpeg and ffprobe shows up in the children times once they have been waited on
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_times = os.times()
+        try:
+            yield
+        finally:
+            end_times = os.times()
+            record = {'stage': name,
+                      'wall': time.perf_counter() - start_wall,
+                      'cpu': time.process_time() - start_cpu,
+                      'child_cpu': max(0.0, (end_times.children_user - start_times.children_user) +
+                                       (end_times.children_system - start_times.children_system))}
+            with self.lock:
+                self.stages.append(record)
+            self.emit('stage', record)
+
+    def record_track(self, number, wall, engine, output_path, returncode=0, cpu=None):
+        """
+        Records the split of a single track, its output size counts towards bytes written
+
+        cpu is the time.thread_time() the track took, None where the track's work isn't done by one thread
+        """
+
+        if not self.enabled:
+            return
+
+        output_bytes = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        record = {'track': number, 'engine': engine, 'wall': wall, 'cpu': cpu, 'returncode': returncode,
+                  'bytes': output_bytes, 'output': output_path}
+        with self.lock:
+            self.tracks.append(record)
+            self.bytes_written += output_bytes
+        self.emit('track', record)
+
+    def record_subprocess(self, cmd):
+        """Counts an ffmpeg or ffprobe instance being started"""
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.subprocesses += 1
+        self.emit('subprocess', {'cmd': cmd})
+
+    def record_bytes(self, count):
+        """Counts bytes written to anything other than split track outputs"""
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.bytes_written += count
+
+    def report(self):
+        """Returns everything recorded as a dict"""
+
+        with self.lock:
+            return {'wall': time.perf_counter() - self.started,
+                    'track_cpu': 'thread cpu time only, ffmpeg cpu time is only counted per stage as child_cpu',
+                    'stages': list(self.stages),
+                    'tracks': list(self.tracks),
+                    'subprocesses': self.subprocesses,
+                    'bytes_written': self.bytes_written}
+
+    def write_report(self, report_path):
+        """Writes report() to report_path as json"""
+
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# shared by every instrumented function in this process
+metrics = Metrics()
+
+
+def timed_stage(function):
+    """Decorator that records every call of function as a metrics stage named after it"""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with metrics.stage(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def run_profiled(profile_path, function, *args, **kwargs):
     """
-    This parses the tracklist csv
+    Calls function with cProfile and tracemalloc running, returns whatever function returns
 
-    tracklist.csv should be 4 rows per column in the format Track#,Artist,Track Title,Track Index in HH:MM:SS
-    if no tracklist csv file is provided, then tracklist.csv is loaded from the same directory as the audio file
+    the cProfile stats are dumped to profile_path, loadable with pstats or snakeviz,
+    the top allocation sites are written to profile_path + '.tracemalloc.txt'
     """
 
-    tracklist_data = []
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(profile_path)
+        with open(profile_path + '.tracemalloc.txt', 'w') as f:
+            f.write('current {} bytes, peak {} bytes\n\n'.format(current, peak))
+            for statistic in snapshot.statistics('lineno')[:50]:
+                f.write(str(statistic) + '\n')
 
-    # loading initial csv into tracklist_data
-    with open(tracklist_path, 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            # csv file expects a HH:MM:SS style index for each track, converting it to raw seconds for easier processing
-            row[3] = get_seconds(row[3])
-            tracklist_data.append(row)
 
-    # appending individual track length to the end of each row
-    for i, row in enumerate(tracklist_data):
-        if i == len(tracklist_data) - 1:
-            duration_seconds = total_duration_seconds - row[3]
-        else:
-            duration_seconds = tracklist_data[i + 1][3] - row[3]
-        row.append(duration_seconds)
+def get_cache_directory():
+    """Returns the directory ecu keeps its caches in, $ECU_CACHE_DIR or ~/.cache/ecu"""
 
-    return tracklist_data
+    return os.environ.get('ECU_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ecu'))
 
 
-# TODO Write tests that actually test the output, only checking for errors right now
-def review_album(working_album):
-    """Prints a readable chart of data of working_album Album, accepts a populated Album object"""
+class DurationCache(object):
+    """
+    Persistent cache of probed audio durations so unchanged files are never probed twice
 
-    # since there is no csv and file sanity checking yet, visual inspection is required
-    print('')
-    print(working_album.audio_file_name)
-    print('')
-    print(working_album.album_title + ' ' + working_album.cue_extension)
-    print('')
-    print('Tracklist')
-    print('')
-    # column headers
-    print('{:>4}'.format('#') + '  ' +
-          '{:<30}'.format('Track Artist')[:24] + '  ' +
-          '{:<30}'.format('Track Title')[:24] + '  ' +
-          '{:>10}'.format('Index')[-10:] + '  ' +
-          '{:>10}'.format('Length')[-10:])
-    print('-' * 80)
-    # data
-    for item in working_album.tracklist_data:
-        print('{:>4}'.format(item[0]) + '  ' +
-              '{:<30}'.format(item[1])[:24] + '  ' +
-              '{:<30}'.format(item[2])[:24] + '  ' +
-              '{:>10}'.format(get_hms(item[3]))[-10:] + '  ' +
-              '{:>10}'.format(get_hms(item[4]))[-10:])
+    entries are keyed by absolute path and only trusted while the file's size and mtime still match
+    the cache is a json file, by default durations.json in $ECU_CACHE_DIR or ~/.cache/ecu
+    once there are more than max_entries the oldest entries are evicted
+    stored durations are held back and written out by flush, which runs once max_pending of them are waiting
+    hits and misses count lookups made by this process
+    """
 
-    # adding total length sanity check remove eventually
-    calculated_length_seconds = 0
-    for row in working_album.tracklist_data:
-        calculated_length_seconds += row[4]
-    print('{:>80}'.format(get_hms(calculated_length_seconds)))
-    print('{:>80}'.format(get_hms(working_album.total_duration_seconds)))
-    # print('')
-    # user_decision = input('Continue? [y/n]:')
-    if not yes_no_decision('Continue?'):
-        print('')
-        print('Exiting')
-        print('')
-        enter_to_continue()
-        sys.exit(0)
+    def __init__(self, cache_path=None, max_entries=10000, max_pending=100):
 
+        if cache_path is None:
+            cache_path = os.path.join(get_cache_directory(), 'durations.json')
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self.hits = 0
+        self.misses = 0
+        self.entries = None
+        self.pending = {}
+        self.lock = threading.Lock()
 
-# TODO TESTS
-def write_cue(album, output_file):
-    """Generates a cue file from populated Album object and target output file"""
+    def load(self):
+        """Reads the cache file, a missing or unreadable cache file is treated as empty"""
 
-    # outputting track section of .cue file
-    cue_output_full_path = album.audio_file_directory + '/' + output_file
-    with open(cue_output_full_path, 'w') as f:
-        f.write('PERFORMER "' + album.album_performer + '"\n')
-        f.write('TITLE "' + album.album_title + '"\n')
-        f.write('FILE "' + album.audio_file_name +
-                '" ' + album.cue_extension + '\n')
-        for item in album.tracklist_data:
-            f.write('  TRACK ' + item[0] + ' AUDIO\n')
-            f.write('    TITLE "' + item[2] + '"\n')
-            f.write('    PERFORMER "' + item[1] + '"\n')
-            f.write('    INDEX 01 ' + get_hms(item[3], hours=False) + ':00\n')
+        try:
+            with open(self.cache_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        if not isinstance(entries, dict):
+            entries = {}
+        return entries
 
-    print('')
-    print('CUE file written.')
-    print('')
+    def lookup(self, audio_file_path):
+        """Returns the cached duration of audio_file_path, or None if it isn't cached or the file has changed"""
 
+        if self.entries is None:
+            self.entries = self.load()
 
-# TODO TESTS
-def split_tracks(working_album):
-    """Splits an audio file in to separate track audio files from a populated Album object"""
+        key = os.path.abspath(audio_file_path)
+        entry = self.entries.get(key)
+        stat = os.stat(audio_file_path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            self.hits += 1
+            return entry[2]
 
-    # create split output directory
-    split_output_directory = working_album.audio_file_directory + '/split'
-    if not os.path.exists(split_output_directory):
-        os.makedirs(split_output_directory)
+        self.misses += 1
+        return None
 
-    # splitting tracks and outputting to audio_file_directory/split directory
-    for row in working_album.tracklist_data:
+    @contextlib.contextmanager
+    def file_lock(self):
+        """Holds an exclusive lock on a file beside the cache file, where fcntl is available"""
 
-        # preparing ffmpeg arguments
-        # track filenames are '# - Artist - Track.extension'
-        track_filename = row[0] + ' - ' + row[1] + ' - ' + row[2] + working_album.audio_file_extension
-        track_output_full_path = split_output_directory + '/' + track_filename
+        if fcntl is None:
+            yield
+            return
+        with open(self.cache_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            yield
 
-        # preparing track index and length respectively
-        track_index = str(row[3])
-        track_length = str(row[4])
+    def store(self, audio_file_path, total_duration_seconds):
+        """Records the duration of audio_file_path, it is written to the cache file by the next flush"""
 
-        # ffmpeg command for splitting audio files into the same format
-        cmd = ['ffmpeg', '-i', working_album.audio_file_path, '-ss', track_index,
-               '-t', track_length, '-c:a', 'copy', '-y', track_output_full_path]
+        stat = os.stat(audio_file_path)
+        key = os.path.abspath(audio_file_path)
+        entry = [stat.st_size, stat.st_mtime_ns, total_duration_seconds, time.time()]
 
-        # TODO figure a way to error out the program if any of these ffmpeg instances error
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1, universal_newlines=True) as p:
-            for line in p.stdout:
-                print(line, end='')
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            self.entries[key] = entry
+            self.pending[key] = entry
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
 
+    def flush(self):
+        """Writes the durations stored since the last flush to the cache file, does nothing if there are none"""
 
-def yes_no_decision(prompt_text, inputter=input):
-    """Asks user a question, returns answer as boolean, by default it uses input(), can be defined for unit testing"""
+        if not self.pending:
+            return
+        cache_directory = os.path.dirname(self.cache_path)
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory, exist_ok=True)
 
-    print('')
-    user_input = inputter('{} [y/n]:'.format(prompt_text))
-    print('')
-    if user_input:
-        if user_input[0].lower() == 'y':
-            return True
-        else:
-            return False
-    else:
+        # serve mode probes from several threads at once and batch and watch mode from several processes,
+        # the entries can't change between being read back and written out
+        with self.lock, self.file_lock():
+            # other processes may have written the cache since it was loaded, their entries are kept
+            self.entries = self.load()
+            self.entries.update(self.pending)
+            self.pending = {}
+            if len(self.entries) > self.max_entries:
+                oldest = sorted(self.entries, key=lambda k: self.entries[k][3])
+                for k in oldest[:len(self.entries) - self.max_entries]:
+                    del self.entries[k]
+
+            # written to a temporary file and swapped in so a concurrent reader never sees half a file
+            fd, temporary_path = tempfile.mkstemp(dir=cache_directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(temporary_path, self.cache_path)
+
+
+# shared by every probe_duration call in this process, whatever it still holds back is written out on exit
+duration_cache = DurationCache()
+atexit.register(lambda: duration_cache.flush())
+
+
+def valid_hms_column(joined):
+    """
+    Checks a newline separated column of values against HMS_FORMAT without matching them one by one
+
+    once the digits are stripped out only separators can be left, fields can't be empty and no line can have
+    more than two colons, an empty value fails the check so the value by value check raises its usual error
+    """
+
+    if not joined:
+        return False
+    separators = joined.translate(HMS_DIGITS)
+    if separators.strip(':\n') or ':::' in separators:
         return False
+    if joined[0] in ':\n' or joined[-1] in ':\n':
+        return False
+    return '::' not in joined and ':\n' not in joined and '\n:' not in joined and '\n\n' not in joined
 
 
-def get_user_input(prompt_text, inputter=input):
-    """separate input function to help with testing"""
+def get_seconds_bulk(hms_values):
+    """
+    Converts a whole column of HH:MM:SS, MM:SS, and SS strings to a list of total seconds ints
 
-    return inputter(prompt_text)
+    validates every value the same way get_seconds does and raises the same errors
+    """
 
+    hms_values = list(hms_values)
+    if not hms_values:
+        return []
 
-def enter_to_continue(inputter=input):
-    """Simple press enter to continue"""
+    # the whole column is validated at once, a value containing a newline would throw off the row count
+    # so those are left to the value by value check
+    joined = '\n'.join(hms_values) if set(map(type, hms_values)) == {str} else None
+    if joined is None or joined.count('\n') != len(hms_values) - 1 or not valid_hms_column(joined):
+        for hms in hms_values:
+            get_seconds(hms)
+        # every value was valid on its own, these lenient ones just don't survive being joined
+        return [get_seconds(hms) for hms in hms_values]
 
-    print('')
-    inputter('Press enter to continue...')
-    print('')
+    # every value is padded out to hours, minutes and seconds fields so the column converts in one go
+    joined = HMS_SECONDS_ONLY.sub('0:0:\\1', joined)
+    joined = HMS_MINUTES_ONLY.sub('0:\\1', joined).replace('\n', ':')
 
+    if numpy is not None:
+        fields = numpy.fromstring(joined, dtype=numpy.int64, sep=':').reshape(-1, 3)
+        return (fields @ numpy.array([3600, 60, 1], dtype=numpy.int64)).tolist()
 
-# TODO TESTS
-def generate(audio_file_path, tracklist_path=None, verbose=False):
+    # nearly every field is one or two digits, looking those up is a lot quicker than int()
+    fields = joined.split(':')
+    field_values = list(map(HMS_FIELD_VALUES.get, fields))
+    if None in field_values:
+        field_values = list(map(int, fields))
+    return [h * 3600 + m * 60 + s for h, m, s in zip(field_values[0::3], field_values[1::3], field_values[2::3])]
+
+
+def get_hms_bulk(seconds_values, hours=True):
     """
-    The generate function, generates a .cue file from a .csv and audio file.
+    Converts a whole column of seconds to HH:MM:SS format strings, see get_hms
 
-    audio_file_path should be a path to an audio file
+    validates every value the same way get_hms does and raises the same errors
+    """
 
-    tracklist_path should be a path to a valid .csv file
+    seconds_values = list(seconds_values)
+    if not seconds_values:
+        return []
 
-    create_cue determines whether a .cue file is generated
+    if not set(map(type, seconds_values)) <= {int, float}:
+        for seconds in seconds_values:
+            if type(seconds) != int and type(seconds) != float:
+                raise TypeError('seconds must be type int or float, received: ' + str(type(seconds)))
 
-    do_split_tracks determines whether the original audio file is split into separate tracks
+    if numpy is not None:
+        values = numpy.array(seconds_values, dtype=numpy.float64)
+        finite = numpy.isfinite(values)
+        if not finite.all():
+            # rounding the first nan or infinity the way the pure python path does raises its ValueError or
+            # OverflowError, numpy would quietly turn it into an arbitrary integer
+            int(round(seconds_values[int(numpy.argmin(finite))]))
+        # rint rounds halves to even just like round() does
+        rounded = numpy.rint(values).astype(numpy.int64)
+        if (rounded < 0).any():
+            raise ValueError('received a negative or invalid value for seconds')
+        rounded = rounded.tolist()
+    else:
+        rounded = [int(round(seconds)) for seconds in seconds_values]
+        if min(rounded) < 0:
+            raise ValueError('received a negative or invalid value for seconds')
 
-    the cue file is generated in the same directory as the audio file
-    the split tracks are generated in a 'split/' subdirectory of the audio file
+    if not hours:
+        return ['%d:%02d' % divmod(seconds, 60) for seconds in rounded]
+
+    # anything under an hour is a table lookup, longer values prefix the hours to the zero padded minutes
+    return [HMS_TABLE[seconds] if seconds < 3600 else
+            str(seconds // 3600) + ':' + HMS_PADDED_TABLE[seconds % 3600] for seconds in rounded]
+
+
+# MPEG audio header tables, indexed by the version bits of the frame header (0 MPEG 2.5, 2 MPEG 2, 3 MPEG 1)
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+# kbps, indexed by [MPEG 1 or not][layer bits][bitrate index], layer bits are 3 for layer I down to 1 for layer III
+MP3_BITRATES = {
+    True: {3: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+           2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+           1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)},
+    False: {3: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+            2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+            1: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)},
+}
+
+
+def parse_mp3_frame_header(header):
     """
-    # TODO change the CSV format to start with Track# THEN Track Index followed by Artist,Track Title
-    # TODO make some nicer error messages if referenced files don't exist
-    # TODO choose custom outputs for cue and split tracks...
+    Decodes the 4 byte header of an MPEG audio frame
 
-    working_album = Album(audio_file_path, tracklist_path)
+    returns a tuple of (frame length in bytes, samples in the frame, sample rate, side information length)
+    or None if header isn't a valid frame header, free format frames are treated as invalid
+    """
 
-    output_file = working_album.album_title + '.cue'
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
 
-    if verbose:
-        working_album.album_performer = get_user_input('Album performer:')
-        if yes_no_decision('Review album data?'):
-            review_album(working_album)
-        if yes_no_decision('Create .cue file?'):
-            write_cue(working_album, output_file)
-        if yes_no_decision('Split tracks?'):
-            split_tracks(working_album)
+    version = (header[1] >> 3) & 3
+    layer = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    mono = header[3] >> 6 == 3
+    padding = (header[2] >> 1) & 1
+    bitrate = MP3_BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+
+    if layer == 3:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
     else:
-        working_album.album_performer = "Various Artists"
-        review_album(working_album)
-        write_cue(working_album, output_file)
-        split_tracks(working_album)
+        samples = 576
+        frame_length = 72 * bitrate // sample_rate + padding
 
-    enter_to_continue()
+    # the Xing header of a VBR file sits right after the layer III side information
+    if mpeg1:
+        side_info_length = 17 if mono else 32
+    else:
+        side_info_length = 9 if mono else 17
 
+    return frame_length, samples, sample_rate, side_info_length
 
-def parse_them_args(args):
-    """Separate function to test argparse configuration"""
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument('audio', help='path to audio file to be processed')
-    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file')
-    parser.add_argument('-v', '--verbose', action='store_true', help='extra user prompts appear')
-    pargs = parser.parse_args(args)
-    return pargs
+def find_mp3_audio_start(data):
+    """Returns the offset of the first MPEG audio frame in data, skipping any ID3v2 tag, or None if there isn't one"""
 
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        # the tag size is a 28 bit syncsafe integer that excludes the header and optional footer
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        offset = 10 + tag_size + (10 if data[5] & 0x10 else 0)
 
-if __name__ == '__main__':
-    # print(sys.argv)
-    parsed_args = parse_them_args(sys.argv[1:])
-    generate(parsed_args.audio, tracklist_path=parsed_args.tracklist, verbose=parsed_args.verbose)
+    return find_mp3_sync(data, offset)
+
+
+def find_mp3_sync(data, offset):
+    """
+    Returns the offset of the first frame at or after offset that is followed by another frame, or None
+
+    a real frame is followed by another frame, which rules out stray sync bytes in tag data or in garbage
+    between frames, a frame too close to the end of data to be followed by another counts as well
+    """
+
+    while offset <= len(data) - 4:
+        offset = data.find(b'\xff', offset)
+        if offset == -1:
+            return None
+        frame = parse_mp3_frame_header(data[offset:offset + 4])
+        if frame is not None:
+            next_header = data[offset + frame[0]:offset + frame[0] + 4]
+            if len(next_header) < 4 or parse_mp3_frame_header(next_header):
+                return offset
+        offset += 1
+    return None
+
+
+def iter_mp3_frames(data, offset):
+    """
+    Yields (frame offset, frame length, samples, sample rate) for the frames of data starting at offset
+
+    garbage between frames, from a damaged download or a tag in the middle of the stream, is skipped
+    by searching forward for the next confirmed frame, see find_mp3_sync
+    """
+
+    while offset + 4 <= len(data):
+        frame = parse_mp3_frame_header(data[offset:offset + 4])
+        if frame is None or offset + frame[0] > len(data):
+            offset = find_mp3_sync(data, offset + 1)
+            if offset is None:
+                break
+            continue
+        yield offset, frame[0], frame[1], frame[2]
+        offset += frame[0]
+
+
+def mp3_duration(data):
+    """
+    Reads the duration of an mp3 from its Xing/Info or VBRI header, or estimates it from the file size if it has
+    neither and its first MP3_CBR_FRAMES frames share a bitrate, only a VBR file without a header has every frame
+    counted
+
+    data is a bytes like object of the whole file, returns seconds as a float or None if no frames are found
+    """
+
+    audio_start = find_mp3_audio_start(data)
+    if audio_start is None:
+        return None
+    frame_length, samples, sample_rate, side_info_length = parse_mp3_frame_header(data[audio_start:audio_start + 4])
+
+    xing_offset = audio_start + 4 + side_info_length
+    if data[xing_offset:xing_offset + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', data[xing_offset + 8:xing_offset + 12])[0]
+            return frames * samples / sample_rate
+
+    vbri_offset = audio_start + 36
+    if data[vbri_offset:vbri_offset + 4] == b'VBRI':
+        frames = struct.unpack('>I', data[vbri_offset + 14:vbri_offset + 18])[0]
+        return frames * samples / sample_rate
+
+    first_frames = list(itertools.islice(iter_mp3_frames(data, audio_start), MP3_CBR_FRAMES))
+    # the version, layer, bitrate and sample rate bits, leaving out the padding, private and channel bits
+    header_bits = set((data[frame[0] + 1], data[frame[0] + 2] & 0xFC) for frame in first_frames)
+    if len(header_bits) == 1:
+        audio_end = len(data)
+        # an ID3v1 tag takes up the last 128 bytes
+        if data[audio_end - 128:audio_end - 125] == b'TAG':
+            audio_end -= 128
+        frame_lengths = set(frame[1] for frame in first_frames)
+        if len(frame_lengths) == 1:
+            # the encoder never pads, so every frame is the same length
+            return (audio_end - audio_start) // frame_lengths.pop() * samples / sample_rate
+        version_layer, bitrate_bits = header_bits.pop()
+        bitrate = MP3_BITRATES[(version_layer >> 3) & 3 == 3][(version_layer >> 1) & 3][bitrate_bits >> 4] * 1000
+        return (audio_end - audio_start) * 8 / bitrate
+
+    total_samples = 0
+    for frame_offset, frame_length, samples, sample_rate in iter_mp3_frames(data, audio_start):
+        total_samples += samples
+    return total_samples / sample_rate
+
+
+def wav_duration(data):
+    """Reads the duration of a RIFF WAVE file from its fmt and data chunks, returns seconds or None"""
+
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ':
+            # a fmt chunk is at least 16 bytes, anything shorter or cut off is a damaged file
+            if chunk_size < 16 or offset + 24 > len(data):
+                return None
+            byte_rate = struct.unpack('<I', data[offset + 16:offset + 20])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # files still being recorded or over 4GB don't have a usable size, the data runs to the end of the file
+            data_size = min(chunk_size, len(data) - offset - 8)
+            return data_size / byte_rate
+        # chunks are word aligned
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def aiff_duration(data):
+    """Reads the duration of an AIFF or AIFF-C file from its COMM chunk, returns seconds or None"""
+
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'COMM':
+            # a COMM chunk is at least 18 bytes, anything shorter or cut off is a damaged file
+            if chunk_size < 18 or offset + 26 > len(data):
+                return None
+            frames = struct.unpack('>I', data[offset + 10:offset + 14])[0]
+            # the sample rate is an 80 bit IEEE 754 extended float
+            exponent, mantissa = struct.unpack('>HQ', data[offset + 16:offset + 26])
+            sample_rate = mantissa * 2.0 ** ((exponent & 0x7FFF) - 16383 - 63)
+            if not sample_rate:
+                return None
+            return frames / sample_rate
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def native_duration(audio_file_path):
+    """
+    Reads the duration of WAVE, AIFF and mp3 files straight from their headers without running ffprobe
+
+    returns seconds as a float, or None if the file isn't one of those formats or its headers can't be read
+    """
+
+    with open(audio_file_path, 'rb') as f:
+        magic = f.read(12)
+        if len(magic) < 12:
+            return None
+        # the file is memory mapped so header parsing and mp3 frame counting only touch the pages they read
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if magic[:4] == b'RIFF' and magic[8:12] == b'WAVE':
+                return wav_duration(data)
+            if magic[:4] == b'FORM' and magic[8:12] in (b'AIFF', b'AIFC'):
+                return aiff_duration(data)
+            if os.path.splitext(audio_file_path)[1].lower() == '.mp3':
+                return mp3_duration(data)
+    return None
+
+
+def build_ffprobe_command(audio_file_path):
+    """Builds the ffprobe command that prints an audio file's duration in seconds, and only errors besides"""
+
+    # ffprobe utility can provide total duration of media file in seconds.
+    return ['ffprobe', '-i', audio_file_path, '-show_entries', 'format=duration', '-v', 'error', '-of', 'csv=p=0']
+
+
+def parse_ffprobe_duration(audio_file_path, returncode, output):
+    """Reads the seconds out of the output of build_ffprobe_command, raises RuntimeError if ffprobe failed"""
+
+    if returncode != 0:
+        raise RuntimeError('ffprobe failed to read ' + audio_file_path + ': ' + output.strip())
+
+    # Stripping line and carriage returns from total_duration_seconds result and converting to float for later use
+    return float(output.replace('\r', '').replace('\n', ''))
+
+
+def ffprobe_duration(audio_file_path):
+    """This uses ffprobe to find an audio file's length and returns seconds as a float"""
+
+    returncode, output = run_ffmpeg(build_ffprobe_command(audio_file_path))
+    return parse_ffprobe_duration(audio_file_path, returncode, output)
+
+
+@timed_stage
+def probe_duration(audio_file_path, use_cache=True):
+    """
+    Finds an audio file's length and returns seconds as a float
+
+    the duration cache is consulted first, then WAVE, AIFF and mp3 headers are read directly,
+    ffprobe only runs for other formats or files whose headers can't be read
+    use_cache=False skips the cache and leaves it untouched
+    """
+
+    if use_cache:
+        total_duration_seconds = duration_cache.lookup(audio_file_path)
+        if total_duration_seconds is not None:
+            return total_duration_seconds
+
+    total_duration_seconds = native_duration(audio_file_path)
+    if total_duration_seconds is None:
+        total_duration_seconds = ffprobe_duration(audio_file_path)
+
+    if use_cache:
+        duration_cache.store(audio_file_path, total_duration_seconds)
+    return total_duration_seconds
+
+
+class Track(object):
+    """
+    A single row of the tracklist, index and length are in seconds
+
+    __slots__ keeps tracklists with tens of thousands of rows small
+    iterating a Track gives number, artist, title, index, length in tracklist.csv column order
+    """
+
+    __slots__ = ('number', 'artist', 'title', 'index', 'length')
+
+    def __init__(self, number, artist, title, index, length=None):
+
+        self.number = number
+        self.artist = artist
+        self.title = title
+        self.index = index
+        self.length = length
+
+    def __iter__(self):
+        return iter((self.number, self.artist, self.title, self.index, self.length))
+
+    def __eq__(self, other):
+        if not isinstance(other, Track):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return 'Track' + repr(tuple(self))
+
+
+def iter_tracklist_csv(tracklist_path, total_duration_seconds):
+    """
+    Parses the tracklist csv one row at a time, yielding a Track per row
+
+    each Track is yielded as soon as the next row arrives, since that is when its length is known,
+    the last track runs to total_duration_seconds, its length is None if total_duration_seconds is None
+    rows are read TRACKLIST_CHUNK_ROWS at a time so their indexes can be converted in bulk
+    """
+
+    previous_track = None
+
+    with open(tracklist_path, 'r') as f:
+        reader = csv.reader(f)
+        while True:
+            rows = list(itertools.islice(reader, TRACKLIST_CHUNK_ROWS))
+            if not rows:
+                break
+            # csv file expects a HH:MM:SS style index for each track, converting it to raw seconds for easier processing
+            indexes = get_seconds_bulk([row[3] for row in rows])
+            for row, index in zip(rows, indexes):
+                track = Track(row[0], row[1], row[2], index)
+                if previous_track is not None:
+                    previous_track.length = track.index - previous_track.index
+                    yield previous_track
+                previous_track = track
+
+    if previous_track is not None:
+        if total_duration_seconds is not None:
+            previous_track.length = total_duration_seconds - previous_track.index
+        yield previous_track
+
+
+@timed_stage
+def parse_tracklist_csv(tracklist_path, total_duration_seconds):
+    """
+    This parses the tracklist csv and returns a list of Track
+
+    tracklist.csv should be 4 rows per column in the format Track#,Artist,Track Title,Track Index in HH:MM:SS
+    if no tracklist csv file is provided, then tracklist.csv is loaded from the same directory as the audio file
+    """
+
+    return list(iter_tracklist_csv(tracklist_path, total_duration_seconds))
+
+
+class TrackIndex(object):
+    """
+    Answers which track is playing at a given time, starts holds every track's index in seconds in tracklist order
+
+    a track plays from its start up to the next one's, the last up to total_duration_seconds,
+    or on indefinitely if that's None, names holds a (number, artist, title) tuple per track
+    """
+
+    def __init__(self, starts, names, total_duration_seconds=None):
+
+        self.starts = array.array('d', starts)
+        self.names = names
+        self.total_duration_seconds = total_duration_seconds
+        self._numpy_starts = None
+
+    @classmethod
+    def from_album(cls, album, probe=True):
+        """Builds the index of an Album, without probe an audio file whose duration isn't cached isn't probed"""
+
+        tracks = album.load_tracks(probe=probe)
+        total_duration_seconds = album.total_duration_seconds if probe or album.duration_known else None
+        return cls([track.index for track in tracks], [(track.number, track.artist, track.title) for track in tracks],
+                   total_duration_seconds)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def end(self, position):
+        """Returns where the track at position stops playing, None for a last track of unknown length"""
+
+        if position + 1 < len(self.starts):
+            return self.starts[position + 1]
+        return self.total_duration_seconds
+
+    def track(self, position):
+        """Returns the Track at position"""
+
+        end = self.end(position)
+        start = self.starts[position]
+        number, artist, title = self.names[position]
+        return Track(number, artist, title, start, None if end is None else end - start)
+
+    def position_at(self, seconds):
+        """Returns the position of the track playing at seconds, -1 before the first track or after the last"""
+
+        position = bisect.bisect_right(self.starts, seconds) - 1
+        if position >= 0 and self.total_duration_seconds is not None and seconds >= self.total_duration_seconds:
+            return -1
+        return position
+
+    def track_at(self, seconds):
+        """Returns the Track playing at seconds or None"""
+
+        position = self.position_at(seconds)
+        return None if position < 0 else self.track(position)
+
+    def lookup(self, seconds_values):
+        """
+        Looks up many timestamps at once, returns the position_at of each one as a list
+
+        with numpy the whole batch is one searchsorted over the starts, which is read in place rather than copied
+        """
+
+        if numpy is None:
+            return [self.position_at(seconds) for seconds in seconds_values]
+
+        if self._numpy_starts is None:
+            self._numpy_starts = numpy.frombuffer(self.starts, dtype=numpy.float64)
+        seconds_values = numpy.asarray(seconds_values, dtype=numpy.float64)
+        positions = numpy.searchsorted(self._numpy_starts, seconds_values, side='right') - 1
+        if self.total_duration_seconds is not None:
+            positions[seconds_values >= self.total_duration_seconds] = -1
+        return positions.tolist()
+
+    def save(self, index_path):
+        """Writes the index to index_path, so it can be loaded without the tracklist or the audio file"""
+
+        starts = array.array('d', self.starts)
+        if sys.byteorder != 'little':
+            starts.byteswap()
+        names = json.dumps(self.names, separators=(',', ':')).encode('utf-8', 'surrogateescape')
+        total_duration_seconds = math.nan if self.total_duration_seconds is None else self.total_duration_seconds
+        index_directory = os.path.dirname(os.path.abspath(index_path))
+        fd, temporary_path = tempfile.mkstemp(dir=index_directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(TRACK_INDEX_MAGIC + TRACK_INDEX_HEADER.pack(total_duration_seconds, len(starts), len(names)))
+            f.write(starts.tobytes())
+            f.write(names)
+        os.replace(temporary_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        """Reads an index written by save, returns None if it's missing or unreadable"""
+
+        try:
+            with open(index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        header_end = len(TRACK_INDEX_MAGIC) + TRACK_INDEX_HEADER.size
+        if data[:len(TRACK_INDEX_MAGIC)] != TRACK_INDEX_MAGIC or len(data) < header_end:
+            return None
+        total_duration_seconds, count, names_length = TRACK_INDEX_HEADER.unpack(
+            data[len(TRACK_INDEX_MAGIC):header_end])
+        starts_end = header_end + count * 8
+        if len(data) != starts_end + names_length:
+            return None
+
+        starts = array.array('d')
+        starts.frombytes(data[header_end:starts_end])
+        if sys.byteorder != 'little':
+            starts.byteswap()
+        try:
+            names = [tuple(name) for name in json.loads(data[starts_end:].decode('utf-8', 'surrogateescape'))]
+        except ValueError:
+            return None
+        if len(names) != count:
+            return None
+        index = cls([], names, None if math.isnan(total_duration_seconds) else total_duration_seconds)
+        index.starts = starts
+        return index
+
+
+# TODO Write tests that actually test the output, only checking for errors right now
+def review_album(working_album):
+    """Prints a readable chart of data of working_album Album, accepts a populated Album object"""
+
+    # since there is no csv and file sanity checking yet, visual inspection is required
+    print('')
+    print(working_album.audio_file_name)
+    print('')
+    print(working_album.album_title + ' ' + working_album.cue_extension)
+    print('')
+    print('Tracklist')
+    print('')
+    # column headers
+    print('{:>4}'.format('#') + '  ' +
+          '{:<30}'.format('Track Artist')[:24] + '  ' +
+          '{:<30}'.format('Track Title')[:24] + '  ' +
+          '{:>10}'.format('Index')[-10:] + '  ' +
+          '{:>10}'.format('Length')[-10:])
+    print('-' * 80)
+    # data
+    indexes = get_hms_bulk(track.index for track in working_album.tracklist_data)
+    lengths = get_hms_bulk(track.length for track in working_album.tracklist_data)
+    for track, index, length in zip(working_album.tracklist_data, indexes, lengths):
+        print('{:>4}'.format(track.number) + '  ' +
+              '{:<30}'.format(track.artist)[:24] + '  ' +
+              '{:<30}'.format(track.title)[:24] + '  ' +
+              '{:>10}'.format(index)[-10:] + '  ' +
+              '{:>10}'.format(length)[-10:])
+
+    # adding total length sanity check remove eventually
+    calculated_length_seconds = 0
+    for track in working_album.tracklist_data:
+        calculated_length_seconds += track.length
+    print('{:>80}'.format(get_hms(calculated_length_seconds)))
+    print('{:>80}'.format(get_hms(working_album.total_duration_seconds)))
+    # print('')
+    # user_decision = input('Continue? [y/n]:')
+    if not yes_no_decision('Continue?'):
+        print('')
+        print('Exiting')
+        print('')
+        enter_to_continue()
+        sys.exit(0)
+
+
+def iter_cue_lines(album):
+    """Yields the cue sheet of a populated Album object one line at a time, each line ends in a newline"""
+
+    yield 'PERFORMER "' + album.album_performer + '"\n'
+    yield 'TITLE "' + album.album_title + '"\n'
+    yield 'FILE "' + album.audio_file_name + '" ' + album.cue_extension + '\n'
+
+    # indexes are converted a chunk at a time so huge tracklists never need a second full copy
+    # only indexes are written, so the audio file is never probed for the last track's length
+    tracks = iter(album.tracks)
+    while True:
+        chunk = list(itertools.islice(tracks, TRACKLIST_CHUNK_ROWS))
+        if not chunk:
+            break
+        indexes = get_hms_bulk((track.index for track in chunk), hours=False)
+        for track, index in zip(chunk, indexes):
+            yield '  TRACK ' + track.number + ' AUDIO\n'
+            yield '    TITLE "' + track.title + '"\n'
+            yield '    PERFORMER "' + track.artist + '"\n'
+            yield '    INDEX 01 ' + index + ':00\n'
+
+
+def write_cue_to(album, sink, buffer_size=65536, encoding=None):
+    """
+    Writes the cue sheet of a populated Album object to any object with a write method
+
+    sink can be an open file, sys.stdout, an io.StringIO or anything else that accepts str,
+    with an encoding the text is encoded first so binary sinks like sockets or archive members work too
+    lines are gathered into writes of roughly buffer_size characters, returns the number of characters written
+    """
+
+    buffered_lines = []
+    buffered_size = 0
+    written = 0
+
+    for line in iter_cue_lines(album):
+        buffered_lines.append(line)
+        buffered_size += len(line)
+        if buffered_size >= buffer_size:
+            block = ''.join(buffered_lines)
+            sink.write(block.encode(encoding) if encoding else block)
+            written += buffered_size
+            buffered_lines = []
+            buffered_size = 0
+
+    if buffered_lines:
+        block = ''.join(buffered_lines)
+        sink.write(block.encode(encoding) if encoding else block)
+        written += buffered_size
+
+    return written
+
+
+@timed_stage
+def write_cue(album, output_file, output_directory=None, printer=print):
+    """
+    Generates a cue file from populated Album object and target output file
+
+    the cue file is written to output_directory, which defaults to the directory of the audio file
+    messages go through printer, print() by default, returns the path of the cue file
+    """
+
+    if output_directory is None:
+        output_directory = album.audio_file_directory
+
+    # outputting track section of .cue file
+    cue_output_full_path = output_directory + '/' + output_file
+    with open(cue_output_full_path, 'w') as f:
+        write_cue_to(album, f)
+    metrics.record_bytes(os.path.getsize(cue_output_full_path))
+
+    printer('')
+    printer('CUE file written.')
+    printer('')
+    return cue_output_full_path
+
+
+def get_track_filename(working_album, track, extension=None):
+    """
+    Returns the output filename of a Track, track filenames are '# - Artist - Track.extension'
+
+    the extension is the audio file's unless another one is given
+    """
+
+    if extension is None:
+        extension = working_album.audio_file_extension
+    return track.number + ' - ' + track.artist + ' - ' + track.title + extension
+
+
+def build_split_command(working_album, track, split_output_directory):
+    """Builds the ffmpeg argument list that cuts a single Track out of the album's audio file"""
+
+    track_output_full_path = split_output_directory + '/' + get_track_filename(working_album, track)
+
+    # preparing track index and length respectively
+    track_index = str(track.index)
+    track_length = str(track.length)
+
+    # ffmpeg command for splitting audio files into the same format
+    cmd = ['ffmpeg', '-i', working_album.audio_file_path, '-ss', track_index,
+           '-t', track_length, '-c:a', 'copy', '-y', track_output_full_path]
+    return cmd
+
+
+def build_segment_command(working_album, segment_pattern):
+    """
+    Builds a single ffmpeg argument list that cuts every track of the album in one read of the audio file
+
+    the segment muxer starts a new file at each track index, segment_pattern is a printf style output path
+    if the first track doesn't start at 0 the first segment is the audio before it and should be discarded
+    """
+
+    segment_times = ','.join(str(track.index) for track in working_album.tracklist_data if track.index > 0)
+
+    cmd = ['ffmpeg', '-i', working_album.audio_file_path, '-map', '0:a', '-c:a', 'copy',
+           '-f', 'segment', '-segment_times', segment_times, '-reset_timestamps', '1',
+           '-y', segment_pattern]
+    return cmd
+
+
+def run_ffmpeg(cmd):
+    """Runs a single ffmpeg command to completion, returns a tuple of (exit status, combined output)"""
+
+    metrics.record_subprocess(cmd)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True) as p:
+        output = p.communicate()[0]
+    return p.returncode, output
+
+
+def split_tracks_per_track(working_album, split_output_directory, jobs, printer=print):
+    """
+    Splits every track with its own ffmpeg instance, up to jobs instances run at once, ffmpeg output goes to printer
+
+    raises RuntimeError once every track has been attempted if any of the ffmpeg instances errored
+    """
+
+    commands = [build_split_command(working_album, track, split_output_directory)
+                for track in working_album.tracklist_data]
+
+    def split_track(track, cmd):
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+        returncode, output = run_ffmpeg(cmd)
+        metrics.record_track(track.number, time.perf_counter() - start, 'per-track', cmd[-1], returncode,
+                             time.thread_time() - start_cpu)
+        return returncode, output
+
+    # ffmpeg does the heavy lifting in its own process, so threads are enough to keep every core busy
+    failed_tracks = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        # map hands results back in tracklist order, so the output of each track is printed in one piece
+        results = executor.map(split_track, working_album.tracklist_data, commands)
+        for track, (returncode, output) in zip(working_album.tracklist_data, results):
+            printer(output, end='')
+            if returncode != 0:
+                failed_tracks.append(track.number)
+
+    if failed_tracks:
+        raise RuntimeError('ffmpeg failed to split track(s): ' + ', '.join(failed_tracks))
+
+
+def build_segment_pattern(working_album, split_output_directory):
+    """Returns the printf style path the segment muxer writes each segment to"""
+
+    # '%' has to be escaped in the directory part of the pattern, the segment muxer formats the whole path
+    return (split_output_directory.replace('%', '%%') + '/' + SEGMENT_PREFIX + '%05d' +
+            working_album.audio_file_extension)
+
+
+def collect_segments(working_album, split_output_directory, returncode):
+    """
+    Renames the segments of a single pass split to their track filenames
+
+    returns True if all of the tracks were written, False if ffmpeg errored or produced an unexpected
+    number of segments, in which case any partial segments are removed
+    """
+
+    segment_files = sorted(name for name in os.listdir(split_output_directory) if name.startswith(SEGMENT_PREFIX))
+    segment_paths = [split_output_directory + '/' + name for name in segment_files]
+
+    # audio before the first track index lands in its own leading segment
+    if working_album.tracklist_data and working_album.tracklist_data[0].index > 0:
+        pregap_segments = 1
+    else:
+        pregap_segments = 0
+
+    if returncode != 0 or len(segment_paths) != len(working_album.tracklist_data) + pregap_segments:
+        for path in segment_paths:
+            os.remove(path)
+        return False
+
+    for path in segment_paths[:pregap_segments]:
+        os.remove(path)
+    # the tracks come out of a single ffmpeg instance, so there is no per track wall time
+    for track, path in zip(working_album.tracklist_data, segment_paths[pregap_segments:]):
+        track_output_full_path = split_output_directory + '/' + get_track_filename(working_album, track)
+        os.replace(path, track_output_full_path)
+        metrics.record_track(track.number, None, 'segment', track_output_full_path)
+    return True
+
+
+def split_tracks_single_pass(working_album, split_output_directory, printer=print):
+    """
+    Splits every track with one ffmpeg instance that reads the audio file once, ffmpeg output goes to printer
+
+    returns True if all of the tracks were written, see collect_segments
+    """
+
+    segment_pattern = build_segment_pattern(working_album, split_output_directory)
+    returncode, output = run_ffmpeg(build_segment_command(working_album, segment_pattern))
+    printer(output, end='')
+    return collect_segments(working_album, split_output_directory, returncode)
+
+
+class PcmLayout(object):
+    """
+    Where the frames of an uncompressed WAVE or AIFF file are and what a header for a slice of them looks like
+
+    container is b'WAVE', b'AIFF' or b'AIFC', header_chunks are the raw fmt chunk (WAVE) or FVER and COMM chunks
+    (AIFF) copied into every track, data_offset is the byte offset of the first frame
+    sample_format is '<i2' or '>i2' for 16 bit integer samples of either byte order and None for anything else
+    """
+
+    def __init__(self, container, sample_rate, block_align, data_offset, frames, header_chunks, channels=1,
+                 sample_format=None):
+
+        self.container = container
+        self.sample_rate = sample_rate
+        self.block_align = block_align
+        self.data_offset = data_offset
+        self.frames = frames
+        self.header_chunks = header_chunks
+        self.channels = channels
+        self.sample_format = sample_format
+
+    def build_header(self, frames):
+        """Returns a tuple of (header, trailer) bytes that wrap frames frames of audio into a complete file"""
+
+        data_size = frames * self.block_align
+        pad = data_size & 1
+
+        if self.container == b'WAVE':
+            riff_size = 4 + len(self.header_chunks) + 8 + data_size + pad
+            header = (b'RIFF' + struct.pack('<I', min(riff_size, 0xFFFFFFFF)) + b'WAVE' + self.header_chunks +
+                      b'data' + struct.pack('<I', min(data_size, 0xFFFFFFFF)))
+        else:
+            # the COMM frame count sits 10 bytes into the chunk, right after the channel count
+            comm_offset = self.header_chunks.index(b'COMM')
+            header_chunks = (self.header_chunks[:comm_offset + 10] + struct.pack('>I', frames) +
+                             self.header_chunks[comm_offset + 14:])
+            ssnd_size = 8 + data_size
+            form_size = 4 + len(header_chunks) + 8 + ssnd_size + pad
+            header = (b'FORM' + struct.pack('>I', min(form_size, 0xFFFFFFFF)) + self.container + header_chunks +
+                      b'SSND' + struct.pack('>III', min(ssnd_size, 0xFFFFFFFF), 0, 0))
+
+        return header, b'\0' * pad
+
+
+def read_pcm_layout(data):
+    """Reads the PcmLayout of an uncompressed WAVE or AIFF file, returns None for anything else"""
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        fmt_chunk = None
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_id = data[offset:offset + 4]
+            chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+            if chunk_id == b'fmt ':
+                if chunk_size < 16 or offset + 24 > len(data):
+                    return None
+                format_tag, channels, sample_rate, byte_rate, block_align, bits_per_sample = struct.unpack(
+                    '<HHIIHH', data[offset + 8:offset + 24])
+                if format_tag not in PCM_WAVE_FORMATS or not block_align:
+                    return None
+                fmt_chunk = bytes(data[offset:offset + 8 + chunk_size + (chunk_size & 1)])
+            elif chunk_id == b'data':
+                if fmt_chunk is None:
+                    return None
+                data_size = min(chunk_size, len(data) - offset - 8)
+                sample_format = '<i2' if format_tag != 3 and bits_per_sample == 16 else None
+                return PcmLayout(b'WAVE', sample_rate, block_align, offset + 8, data_size // block_align, fmt_chunk,
+                                 channels, sample_format)
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+    elif data[:4] == b'FORM' and data[8:12] in (b'AIFF', b'AIFC'):
+        container = bytes(data[8:12])
+        header_chunks = b''
+        comm = None
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_id = data[offset:offset + 4]
+            chunk_size = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+            chunk = bytes(data[offset:offset + 8 + chunk_size + (chunk_size & 1)])
+            if chunk_id == b'FVER':
+                header_chunks += chunk
+            elif chunk_id == b'COMM':
+                if chunk_size < 18 or len(chunk) < 26:
+                    return None
+                channels, frames, sample_size, exponent, mantissa = struct.unpack('>hIhHQ', chunk[8:26])
+                if container == b'AIFC' and chunk[26:30] not in PCM_AIFC_COMPRESSIONS:
+                    return None
+                sample_rate = mantissa * 2.0 ** ((exponent & 0x7FFF) - 16383 - 63)
+                block_align = channels * ((sample_size + 7) // 8)
+                compression = chunk[26:30] if container == b'AIFC' else b'NONE'
+                sample_format = None
+                if sample_size == 16 and compression in (b'NONE', b'twos'):
+                    sample_format = '>i2'
+                elif sample_size == 16 and compression == b'sowt':
+                    sample_format = '<i2'
+                comm = (frames, sample_rate, block_align, channels, sample_format)
+                header_chunks += chunk
+            elif chunk_id == b'SSND':
+                if comm is None or not comm[2] or not comm[1] or len(chunk) < 16:
+                    return None
+                frames, sample_rate, block_align, channels, sample_format = comm
+                data_offset = offset + 16 + struct.unpack('>I', chunk[8:12])[0]
+                available = min(chunk_size - 8, len(data) - data_offset)
+                return PcmLayout(container, sample_rate, block_align, data_offset,
+                                 min(frames, available // block_align), header_chunks, channels, sample_format)
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+    return None
+
+
+def copy_range(source_fd, source_data, offset, length, output_fd):
+    """
+    Appends length bytes at offset of the source file to output_fd
+
+    the copy stays in the kernel with os.copy_file_range or os.sendfile where the platform and filesystems allow,
+    otherwise slices of source_data, the memory mapped source, are written out
+    """
+
+    end = offset + length
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(source_fd, output_fd, end - offset, offset_src=offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError:
+            pass
+
+    if offset < end and hasattr(os, 'sendfile'):
+        try:
+            while offset < end:
+                sent = os.sendfile(output_fd, source_fd, offset, end - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError:
+            pass
+
+    with memoryview(source_data) as view:
+        while offset < end:
+            offset += os.write(output_fd, view[offset:min(end, offset + COPY_CHUNK_SIZE)])
+
+
+class Mp3FrameIndex(object):
+    """
+    Byte offset of every audio frame of an mp3, frame i spans offsets[i] up to offsets[i + 1]
+
+    offsets holds one more entry than there are frames, the end of the last frame,
+    a Xing, Info or VBRI frame at the start of the file isn't audio and isn't indexed
+    """
+
+    def __init__(self, sample_rate, samples_per_frame, offsets):
+
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        self.offsets = offsets
+
+    @property
+    def frames(self):
+        return len(self.offsets) - 1
+
+    def frame_at(self, seconds):
+        """Returns the frame boundary nearest seconds"""
+
+        return min(max(int(round(seconds * self.sample_rate / self.samples_per_frame)), 0), self.frames)
+
+    def byte_range(self, start_seconds, end_seconds):
+        """Returns a tuple of (offset, length) of the frames between the boundaries nearest start and end"""
+
+        start_frame = self.frame_at(start_seconds)
+        end_frame = max(self.frame_at(end_seconds), start_frame)
+        return self.offsets[start_frame], self.offsets[end_frame] - self.offsets[start_frame]
+
+    def save(self, index_path, size, mtime_ns):
+        """Writes the index to index_path, stamped with the size and mtime_ns of the mp3 it was built from"""
+
+        offsets = array.array('Q', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        index_directory = os.path.dirname(index_path)
+        if not os.path.exists(index_directory):
+            os.makedirs(index_directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=index_directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MP3_INDEX_MAGIC + MP3_INDEX_HEADER.pack(size, mtime_ns, self.sample_rate,
+                                                            self.samples_per_frame, self.frames))
+            f.write(offsets.tobytes())
+        os.replace(temporary_path, index_path)
+
+    @classmethod
+    def load(cls, index_path, size, mtime_ns):
+        """Reads an index written by save, returns None if it's missing, unreadable or from a different file"""
+
+        try:
+            with open(index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        header_end = len(MP3_INDEX_MAGIC) + MP3_INDEX_HEADER.size
+        if data[:len(MP3_INDEX_MAGIC)] != MP3_INDEX_MAGIC or len(data) < header_end:
+            return None
+        cached_size, cached_mtime_ns, sample_rate, samples_per_frame, frames = MP3_INDEX_HEADER.unpack(
+            data[len(MP3_INDEX_MAGIC):header_end])
+        if cached_size != size or cached_mtime_ns != mtime_ns or len(data) != header_end + (frames + 1) * 8:
+            return None
+
+        offsets = array.array('Q')
+        offsets.frombytes(data[header_end:])
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        return cls(sample_rate, samples_per_frame, offsets)
+
+
+def build_mp3_frame_index(data):
+    """Scans every frame of an mp3 once and returns its Mp3FrameIndex, or None if no frames are found"""
+
+    audio_start = find_mp3_audio_start(data)
+    if audio_start is None:
+        return None
+    frame_length, samples, sample_rate, side_info_length = parse_mp3_frame_header(data[audio_start:audio_start + 4])
+
+    # the Xing/Info or VBRI frame only carries the encoder's header, a decoder plays it as silence
+    xing_offset = audio_start + 4 + side_info_length
+    if (data[xing_offset:xing_offset + 4] in (b'Xing', b'Info') or
+            data[audio_start + 36:audio_start + 40] == b'VBRI'):
+        audio_start += frame_length
+
+    offsets = array.array('Q')
+    end = audio_start
+    for frame_offset, frame_length, samples, sample_rate in iter_mp3_frames(data, audio_start):
+        offsets.append(frame_offset)
+        end = frame_offset + frame_length
+    if not offsets:
+        return None
+    offsets.append(end)
+    return Mp3FrameIndex(sample_rate, samples, offsets)
+
+
+def get_mp3_index_path(audio_file_path):
+    """Returns where the frame index of audio_file_path is cached, one file per absolute path"""
+
+    key = hashlib.sha1(os.path.abspath(audio_file_path).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(get_cache_directory(), 'mp3index', key + '.idx')
+
+
+def prune_mp3_indexes(index_directory, max_files=MP3_INDEX_MAX_FILES):
+    """Deletes the least recently used cached frame indexes once there are more than max_files of them"""
+
+    try:
+        index_paths = [os.path.join(index_directory, name) for name in os.listdir(index_directory)
+                       if name.endswith('.idx')]
+    except OSError:
+        return
+    if len(index_paths) <= max_files:
+        return
+
+    def last_used(index_path):
+        try:
+            return os.stat(index_path).st_mtime
+        except OSError:
+            return 0
+
+    for index_path in sorted(index_paths, key=last_used)[:len(index_paths) - max_files]:
+        try:
+            os.remove(index_path)
+        except OSError:
+            pass
+
+
+# the frame indexes this process used last, keyed by absolute path, size and mtime, see get_mp3_frame_index
+mp3_index_memory = {}
+mp3_index_memory_lock = threading.Lock()
+
+
+def remember_mp3_index(key, index):
+    """Keeps index in mp3_index_memory as its most recently used entry, dropping the oldest past the limit"""
+
+    with mp3_index_memory_lock:
+        mp3_index_memory.pop(key, None)
+        mp3_index_memory[key] = index
+        while len(mp3_index_memory) > MP3_INDEX_MEMORY_FILES:
+            del mp3_index_memory[next(iter(mp3_index_memory))]
+
+
+def get_mp3_frame_index(audio_file_path, data, use_cache=True):
+    """
+    Returns the Mp3FrameIndex of audio_file_path, data is the memory mapped file
+
+    the index is cached beside the duration cache and reused for as long as the file's size and mtime match,
+    so splitting the same mp3 again with a corrected tracklist doesn't scan it again
+    the last MP3_INDEX_MEMORY_FILES indexes used are also kept in memory, so a serve mode process only reads
+    an index from disk the first time one of its jobs needs it
+    an index's mtime is bumped whenever it is read from disk and the cache is pruned to MP3_INDEX_MAX_FILES by it,
+    so indexes of renamed or deleted files age out
+    """
+
+    stat = os.stat(audio_file_path)
+    key = (os.path.abspath(audio_file_path), stat.st_size, stat.st_mtime_ns)
+    index_path = get_mp3_index_path(audio_file_path)
+    if use_cache:
+        with mp3_index_memory_lock:
+            index = mp3_index_memory.get(key)
+        if index is not None:
+            remember_mp3_index(key, index)
+            return index
+        index = Mp3FrameIndex.load(index_path, stat.st_size, stat.st_mtime_ns)
+        if index is not None:
+            try:
+                os.utime(index_path)
+            except OSError:
+                pass
+            remember_mp3_index(key, index)
+            return index
+
+    index = build_mp3_frame_index(data)
+    if index is not None and use_cache:
+        remember_mp3_index(key, index)
+        try:
+            index.save(index_path, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        prune_mp3_indexes(os.path.dirname(index_path))
+    return index
+
+
+def plan_pcm_split(working_album, layout, split_output_directory):
+    """
+    Works out the output path, header, trailer and source byte range of every track of a PCM album
+
+    tracks are cut on the frame nearest each index, returns a list of (track, path, header, offset, length, trailer)
+    """
+
+    plan = []
+    for track in working_album.tracklist_data:
+        start_frame = min(int(round(track.index * layout.sample_rate)), layout.frames)
+        end_frame = min(int(round((track.index + track.length) * layout.sample_rate)), layout.frames)
+        frames = max(end_frame - start_frame, 0)
+        header, trailer = layout.build_header(frames)
+        track_output_full_path = split_output_directory + '/' + get_track_filename(working_album, track)
+        plan.append((track, track_output_full_path, header, layout.data_offset + start_frame * layout.block_align,
+                     frames * layout.block_align, trailer))
+    return plan
+
+
+def plan_mp3_split(working_album, index, split_output_directory):
+    """
+    Works out the output path and source byte range of every track of an mp3 album, see plan_pcm_split
+
+    raises ValueError if the frames found end before the last track does, rather than writing short tracks
+    tracks are cut on the frame boundary nearest each index, so a cut can be up to half a frame (13ms at 44.1kHz)
+    off, the frames are copied as they are so nothing is re-encoded, but a track's first frame may lean on the
+    bit reservoir of the frame before it that went to the previous track, which decoders play as a few
+    milliseconds of silence, the same as ffmpeg's stream copy does
+    """
+
+    indexed_seconds = index.frames * index.samples_per_frame / index.sample_rate
+    plan = []
+    for track in working_album.tracklist_data:
+        if track.index + track.length > indexed_seconds + MP3_INDEX_TOLERANCE:
+            raise ValueError('the mp3 frames of {} end at {:.3f} seconds, before track {} ends at {:.3f} '
+                             'seconds'.format(working_album.audio_file_path, indexed_seconds, track.number,
+                                              track.index + track.length))
+        offset, length = index.byte_range(track.index, track.index + track.length)
+        track_output_full_path = split_output_directory + '/' + get_track_filename(working_album, track)
+        plan.append((track, track_output_full_path, b'', offset, length, b''))
+    return plan
+
+
+def plan_native_split(working_album, source_data, split_output_directory, use_cache=True):
+    """Plans the split of an uncompressed WAVE, AIFF or mp3 album, returns None if it's none of those"""
+
+    layout = read_pcm_layout(source_data)
+    if layout is not None:
+        return plan_pcm_split(working_album, layout, split_output_directory)
+    if working_album.audio_file_extension.lower() == '.mp3':
+        index = get_mp3_frame_index(working_album.audio_file_path, source_data, use_cache=use_cache)
+        if index is not None:
+            return plan_mp3_split(working_album, index, split_output_directory)
+    return None
+
+
+def split_tracks_native(working_album, split_output_directory, jobs, use_cache=True):
+    """
+    Splits an uncompressed WAVE, AIFF or mp3 album without ffmpeg, each track is a slice of the source
+
+    PCM tracks get a new header, mp3 tracks are whole frames, the source is memory mapped once and up to jobs
+    tracks are copied at once, use_cache controls the mp3 frame index cache,
+    raises ValueError if the audio file isn't uncompressed WAVE, AIFF or mp3
+    """
+
+    with open(working_album.audio_file_path, 'rb') as source:
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as source_data:
+            plan = plan_native_split(working_album, source_data, split_output_directory, use_cache=use_cache)
+            if plan is None:
+                raise ValueError('the native engine only splits uncompressed WAVE and AIFF files and mp3 files, '
+                                 'received: ' + working_album.audio_file_path)
+
+            def split_track(plan_entry):
+                track, track_output_full_path, header, offset, length, trailer = plan_entry
+                start = time.perf_counter()
+                start_cpu = time.thread_time()
+                output_fd = os.open(track_output_full_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o666)
+                try:
+                    os.write(output_fd, header)
+                    copy_range(source.fileno(), source_data, offset, length, output_fd)
+                    os.write(output_fd, trailer)
+                finally:
+                    os.close(output_fd)
+                metrics.record_track(track.number, time.perf_counter() - start, 'native', track_output_full_path,
+                                     cpu=time.thread_time() - start_cpu)
+
+            # the copies spend their time in the kernel or in memcpy, so threads are enough to overlap them
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(split_track, plan))
+
+
+def native_layout(working_album):
+    """Returns the PcmLayout of the album's audio file if it's uncompressed WAVE or AIFF, otherwise None"""
+
+    with open(working_album.audio_file_path, 'rb') as f:
+        magic = f.read(12)
+        if magic[:4] not in (b'RIFF', b'FORM'):
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return read_pcm_layout(data)
+
+
+def native_split_supported(working_album):
+    """Checks whether the native engine can split the album's audio file without reading all of it"""
+
+    if native_layout(working_album) is not None:
+        return True
+    if working_album.audio_file_extension.lower() != '.mp3':
+        return False
+    with open(working_album.audio_file_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return find_mp3_audio_start(data) is not None
+
+
+def resolve_split_engine(working_album, engine):
+    """Turns the 'auto' engine into the engine that suits the album, 'native' where possible, otherwise 'segment'"""
+
+    if engine != 'auto':
+        return engine
+    if native_split_supported(working_album):
+        return 'native'
+    return 'segment'
+
+
+def prepare_split(working_album, jobs, engine):
+    """
+    Validates the split_tracks arguments and creates the split output directory
+
+    returns a tuple of (jobs, split output directory, track output paths in tracklist order)
+    """
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    elif jobs < 1:
+        raise ValueError('jobs must be at least 1, received: ' + str(jobs))
+    if engine not in SPLIT_ENGINES:
+        raise ValueError('engine must be one of ' + ', '.join(SPLIT_ENGINES) + ', received: ' + str(engine))
+
+    # create split output directory
+    split_output_directory = working_album.audio_file_directory + '/split'
+    if not os.path.exists(split_output_directory):
+        os.makedirs(split_output_directory)
+    track_paths = [split_output_directory + '/' + get_track_filename(working_album, track)
+                   for track in working_album.tracklist_data]
+
+    return jobs, split_output_directory, track_paths
+
+
+def get_source_identity(audio_file_path):
+    """Returns the absolute path, size and mtime of an audio file, split tracks are only reused while it matches"""
+
+    stat = os.stat(audio_file_path)
+    return {'path': os.path.abspath(audio_file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def get_engine_family(engine):
+    """Tracks cut by the same family of engines are interchangeable, 'native' cuts differ from ffmpeg's"""
+
+    return 'native' if engine == 'native' else 'ffmpeg'
+
+
+def checksum_file(path, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Returns a tuple of (size, sha1 hex digest, crc32 as 8 hex digits) of a file in a single read
+
+    the file is memory mapped and fed to both checksums chunk_size bytes at a time without copying,
+    hashlib and zlib let go of the GIL for chunks that size, so threads checksum files in parallel
+    """
+
+    digest = hashlib.sha1()
+    crc = 0
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    for offset in range(0, size, chunk_size):
+                        digest.update(view[offset:offset + chunk_size])
+                        crc = zlib.crc32(view[offset:offset + chunk_size], crc)
+    return size, digest.hexdigest(), '{:08x}'.format(crc)
+
+
+def load_split_manifest(split_output_directory):
+    """Reads the manifest of a split output directory, a missing or unreadable manifest is treated as empty"""
+
+    try:
+        with open(split_output_directory + '/' + SPLIT_MANIFEST_NAME, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'source': None, 'tracks': []}
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('tracks'), list):
+        return {'source': None, 'tracks': []}
+    return manifest
+
+
+def manifest_entry_intact(split_output_directory, entry):
+    """Checks that the output a manifest entry describes is still there and hasn't been touched since"""
+
+    try:
+        stat = os.stat(split_output_directory + '/' + entry['file'])
+    except OSError:
+        return False
+    return stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']
+
+
+def get_cut_key(track, family):
+    """What a split track's audio depends on besides the source, rounded so float noise doesn't count as an edit"""
+
+    return round(track.index, 6), round(track.length, 6), family
+
+
+def reconcile_split(working_album, split_output_directory, engine):
+    """
+    Brings the split output directory in line with the tracklist before splitting, using the manifest of the last split
+
+    tracks cut from the same source at the same start and length by the same engine family are kept, renamed if
+    only their artist, title or number changed, outputs of the last split that no track needs any more are deleted,
+    files the manifest doesn't list are left alone
+    returns a tuple of (album of the tracks still to split or None if there are none, engine to split them with)
+    """
+
+    manifest = load_split_manifest(split_output_directory)
+    family = get_engine_family(engine)
+    same_source = manifest['source'] == get_source_identity(working_album.audio_file_path)
+
+    reusable = {}
+    if same_source:
+        for entry in manifest['tracks']:
+            if entry.get('family') == family and manifest_entry_intact(split_output_directory, entry):
+                key = (round(entry['start'], 6), round(entry['length'], 6), family)
+                reusable.setdefault(key, []).append(entry)
+
+    # a track keeps its own output where it can, so only genuinely moved outputs get renamed
+    claimed = set()
+    pending = []
+    renames = []
+    wanted = [(track, get_track_filename(working_album, track)) for track in working_album.tracklist_data]
+    unplaced = []
+    for track, filename in wanted:
+        candidates = reusable.get(get_cut_key(track, family), [])
+        entry = next((entry for entry in candidates if entry['file'] == filename), None)
+        if entry is not None:
+            candidates.remove(entry)
+            claimed.add(entry['file'])
+        else:
+            unplaced.append((track, filename))
+    for track, filename in unplaced:
+        candidates = reusable.get(get_cut_key(track, family), [])
+        if candidates:
+            entry = candidates.pop(0)
+            claimed.add(entry['file'])
+            renames.append((entry['file'], filename))
+        else:
+            pending.append(track)
+
+    for number, (old_filename, new_filename) in enumerate(renames):
+        os.replace(split_output_directory + '/' + old_filename,
+                   split_output_directory + '/' + RENAME_PREFIX + str(number))
+    for entry in manifest['tracks']:
+        orphan_path = split_output_directory + '/' + entry['file']
+        if entry['file'] not in claimed and os.path.exists(orphan_path):
+            os.remove(orphan_path)
+    for number, (old_filename, new_filename) in enumerate(renames):
+        os.replace(split_output_directory + '/' + RENAME_PREFIX + str(number),
+                   split_output_directory + '/' + new_filename)
+
+    if not pending:
+        return None, engine
+    if len(pending) == len(working_album.tracklist_data):
+        return working_album, engine
+
+    pending_album = copy.copy(working_album)
+    pending_album.tracklist_data = pending
+    # the segment engine cuts the whole album in one go, a handful of tracks is cheaper one by one
+    if engine == 'segment':
+        engine = 'per-track'
+    return pending_album, engine
+
+
+def write_split_manifest(working_album, split_output_directory, engine, jobs):
+    """
+    Records the source, cut and output of every split track so the next split can skip unchanged tracks
+
+    outputs that haven't changed since the last manifest keep their hash, the rest are hashed up to jobs at once,
+    tracks whose output is missing are left out so they are split again next time
+    """
+
+    previous = {entry['file']: entry for entry in load_split_manifest(split_output_directory)['tracks']}
+    family = get_engine_family(engine)
+
+    def describe(track):
+        filename = get_track_filename(working_album, track)
+        output_path = split_output_directory + '/' + filename
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            return None
+        entry = {'number': track.number, 'artist': track.artist, 'title': track.title, 'start': track.index,
+                 'length': track.length, 'family': family, 'file': filename, 'size': stat.st_size,
+                 'mtime_ns': stat.st_mtime_ns}
+        old_entry = previous.get(filename)
+        if old_entry is not None and old_entry.get('sha1') and manifest_entry_intact(split_output_directory, old_entry):
+            entry['sha1'] = old_entry['sha1']
+        else:
+            entry['sha1'] = checksum_file(output_path)[1]
+        return entry
+
+    # hashlib releases the GIL on large buffers, so threads hash in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = [entry for entry in executor.map(describe, working_album.tracklist_data) if entry is not None]
+
+    manifest = {'version': 1, 'source': get_source_identity(working_album.audio_file_path), 'tracks': entries}
+    fd, temporary_path = tempfile.mkstemp(dir=split_output_directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary_path, split_output_directory + '/' + SPLIT_MANIFEST_NAME)
+
+
+def run_split_engine(working_album, split_output_directory, jobs, engine, printer=print):
+    """Splits every track of working_album with an already resolved engine, see split_tracks"""
+
+    if engine == 'native':
+        split_tracks_native(working_album, split_output_directory, jobs)
+        return
+
+    if engine == 'segment':
+        if split_tracks_single_pass(working_album, split_output_directory, printer=printer):
+            return
+        printer('')
+        printer('Single pass split failed, splitting track by track.')
+        printer('')
+
+    split_tracks_per_track(working_album, split_output_directory, jobs, printer=printer)
+
+
+@timed_stage
+def split_tracks(working_album, jobs=None, engine='auto', printer=print, incremental=True):
+    """
+    Splits an audio file in to separate track audio files from a populated Album object
+
+    engine 'native' copies each track straight out of uncompressed WAVE, AIFF and mp3 files without ffmpeg,
+    'segment' reads the audio file once with a single ffmpeg instance and falls back to 'per-track'
+    if that fails, 'per-track' runs an ffmpeg instance per track with up to jobs of them at once,
+    'auto' picks 'native' where it can and 'segment' otherwise
+    jobs defaults to the number of cores on the machine
+    with incremental, tracks the last split already cut the same way are kept, see reconcile_split
+    ffmpeg output and messages go through printer, print() by default
+    returns the paths of the split tracks in tracklist order
+    raises RuntimeError if any track could not be split
+    """
+
+    jobs, split_output_directory, track_paths = prepare_split(working_album, jobs, engine)
+    engine = resolve_split_engine(working_album, engine)
+
+    # splitting tracks and outputting to audio_file_directory/split directory
+    pending_album = working_album
+    if incremental:
+        pending_album, engine = reconcile_split(working_album, split_output_directory, engine)
+    if pending_album is not None:
+        run_split_engine(pending_album, split_output_directory, jobs, engine, printer=printer)
+
+    write_split_manifest(working_album, split_output_directory, engine, jobs)
+    return track_paths
+
+
+def group_tracks(tracks, groups, max_size=None):
+    """
+    Divides tracks into at most groups runs of consecutive tracks of roughly equal total length
+
+    with max_size no run has more than max_size tracks, which takes more than groups runs when there are more than
+    groups * max_size tracks
+    returns a list of lists of Track, no list is empty
+    """
+
+    tracks = list(tracks)
+    if max_size is not None:
+        groups = max(groups, -(-len(tracks) // max_size))
+    groups = max(min(groups, len(tracks)), 1)
+    total_length = sum(track.length for track in tracks)
+    grouped = [[]]
+    grouped_length = 0.0
+    for position, track in enumerate(tracks):
+        # a new group starts once this one has its share, as long as every later group can still get a track
+        remaining_groups = groups - len(grouped)
+        if grouped[-1] and (len(grouped[-1]) == max_size or remaining_groups and
+                            (grouped_length >= total_length * len(grouped) / groups or
+                             len(tracks) - position <= remaining_groups)):
+            grouped.append([])
+        grouped[-1].append(track)
+        grouped_length += track.length
+    return grouped
+
+
+def build_transcode_command(working_album, tracks, formats, transcode_output_directory):
+    """
+    Builds a single ffmpeg argument list that decodes a run of consecutive tracks once and encodes every track
+    to every format
+
+    the run is seeked to and decoded once, the asegment filter cuts it at each track index and asplit hands each
+    track to one encoder per format, every output drops the source's tags and gets the track's number, artist and
+    title instead
+    outputs go to transcode_output_directory/format/, asegment needs ffmpeg 4.4 or newer
+    """
+
+    start = tracks[0].index
+    end = tracks[-1].index + tracks[-1].length
+
+    if len(tracks) > 1:
+        timestamps = '|'.join(str(track.index - start) for track in tracks[1:])
+        filters = ['[0:a]asegment=timestamps=' + timestamps + ''.join('[s' + str(i) + ']' for i in range(len(tracks)))]
+    else:
+        filters = ['[0:a]anull[s0]']
+
+    outputs = []
+    for i, track in enumerate(tracks):
+        # each segment keeps the timestamps of the whole run, every track should start at 0
+        if len(formats) > 1:
+            filters.append('[s{0}]asetpts=PTS-STARTPTS,asplit={1}'.format(i, len(formats)) +
+                           ''.join('[t{0}f{1}]'.format(i, j) for j in range(len(formats))))
+        else:
+            filters.append('[s{0}]asetpts=PTS-STARTPTS[t{0}f0]'.format(i))
+        for j, transcode_format in enumerate(formats):
+            extension, encoder_arguments = TRANSCODE_PRESETS[transcode_format]
+            output_path = (transcode_output_directory + '/' + transcode_format + '/' +
+                           get_track_filename(working_album, track, extension))
+            # output options only apply to the output that follows them, so every output repeats them
+            outputs += (['-map', '[t{0}f{1}]'.format(i, j), '-map_metadata', '-1'] + encoder_arguments +
+                        ['-metadata', 'track=' + track.number, '-metadata', 'artist=' + track.artist,
+                         '-metadata', 'title=' + track.title, '-metadata', 'album=' + working_album.album_title,
+                         '-y', output_path])
+
+    cmd = (['ffmpeg', '-ss', str(start), '-t', str(end - start), '-i', working_album.audio_file_path,
+            '-filter_complex', ';'.join(filters)] + outputs)
+    return cmd
+
+
+@timed_stage
+def transcode_tracks(working_album, formats, jobs=None, printer=print):
+    """
+    Encodes every track of an Album to each of formats, see TRANSCODE_PRESETS, without decoding anything twice
+
+    the tracks are divided into up to jobs runs of consecutive tracks, each run is decoded once by its own ffmpeg
+    instance that encodes all of its tracks to all formats, so the runs keep jobs cores busy between them,
+    a run is split further so no instance writes more than TRANSCODE_MAX_OUTPUTS files
+    outputs go to a 'transcoded/format/' subdirectory of the audio file per format
+    jobs defaults to the number of cores, ffmpeg output goes to printer
+    returns a dict of format to the paths of its tracks in tracklist order
+    raises RuntimeError if any run failed
+    """
+
+    formats = list(dict.fromkeys(formats))
+    if not formats:
+        raise ValueError('at least one format is needed')
+    for transcode_format in formats:
+        if transcode_format not in TRANSCODE_PRESETS:
+            raise ValueError('format must be one of ' + ', '.join(sorted(TRANSCODE_PRESETS)) +
+                             ', received: ' + str(transcode_format))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    elif jobs < 1:
+        raise ValueError('jobs must be at least 1, received: ' + str(jobs))
+
+    transcode_output_directory = working_album.audio_file_directory + '/transcoded'
+    for transcode_format in formats:
+        if not os.path.exists(transcode_output_directory + '/' + transcode_format):
+            os.makedirs(transcode_output_directory + '/' + transcode_format)
+
+    groups = group_tracks(working_album.tracklist_data, jobs, max(TRANSCODE_MAX_OUTPUTS // len(formats), 1))
+
+    def transcode_group(tracks):
+        cmd = build_transcode_command(working_album, tracks, formats, transcode_output_directory)
+        start = time.perf_counter()
+        returncode, output = run_ffmpeg(cmd)
+        wall = time.perf_counter() - start
+        for track in tracks:
+            for transcode_format in formats:
+                output_path = (transcode_output_directory + '/' + transcode_format + '/' +
+                               get_track_filename(working_album, track, TRANSCODE_PRESETS[transcode_format][0]))
+                metrics.record_track(track.number, wall, 'transcode ' + transcode_format, output_path, returncode)
+        return returncode, output
+
+    failed_tracks = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for tracks, (returncode, output) in zip(groups, executor.map(transcode_group, groups)):
+            printer(output, end='')
+            if returncode != 0:
+                failed_tracks += [track.number for track in tracks]
+
+    if failed_tracks:
+        raise RuntimeError('ffmpeg failed to transcode track(s): ' + ', '.join(failed_tracks))
+
+    return dict((transcode_format, [transcode_output_directory + '/' + transcode_format + '/' +
+                                    get_track_filename(working_album, track, TRANSCODE_PRESETS[transcode_format][0])
+                                    for track in working_album.tracklist_data])
+                for transcode_format in formats)
+
+
+class ChunkReader(object):
+    """
+    File-like reader over an iterable of bytes-like chunks, so tarfile and shutil can copy from it
+
+    size is the total length if it's known up front, chunks are only pulled as they're read
+    """
+
+    def __init__(self, chunks, size=None):
+
+        self.chunks = iter(chunks)
+        self.size = size
+        self.pending = b''
+
+    def read(self, n=-1):
+        parts = []
+        wanted = n
+        while n < 0 or wanted > 0:
+            while not self.pending and self.pending is not None:
+                self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b''
+                break
+            if n < 0 or len(self.pending) <= wanted:
+                parts.append(bytes(self.pending))
+                wanted -= len(self.pending)
+                self.pending = b''
+            else:
+                parts.append(bytes(self.pending[:wanted]))
+                self.pending = self.pending[wanted:]
+                wanted = 0
+        return b''.join(parts)
+
+
+def iter_native_track(source_data, header, offset, length, trailer):
+    """Yields the header, the source slice in COPY_CHUNK_SIZE pieces and the trailer of a planned native track"""
+
+    yield header
+    # slicing the map copies each piece out, a memoryview would pin the map open if a reader stopped early
+    for chunk_offset in range(offset, offset + length, COPY_CHUNK_SIZE):
+        yield source_data[chunk_offset:min(offset + length, chunk_offset + COPY_CHUNK_SIZE)]
+    yield trailer
+
+
+def build_pipe_command(working_album, track):
+    """Builds the ffmpeg argument list that cuts a single Track out of the album's audio file to stdout"""
+
+    muxer = PIPE_MUXERS.get(working_album.audio_file_extension.lower())
+    if muxer is None:
+        raise ValueError('no muxer to stream ' + working_album.audio_file_extension + ' tracks with')
+    cmd = ['ffmpeg', '-i', working_album.audio_file_path, '-ss', str(track.index), '-t', str(track.length),
+           '-c:a', 'copy'] + muxer + ['pipe:1']
+    return cmd
+
+
+@contextlib.contextmanager
+def open_pipe_track(working_album, track):
+    """
+    Runs ffmpeg on a single track and gives a ChunkReader over its stdout
+
+    ffmpeg's own output is drained on a thread so neither pipe can fill up and stall it,
+    raises RuntimeError with that output if ffmpeg fails, from the read that reaches the end of its output,
+    so a failed track never looks like a complete one to whatever is copying it
+    """
+
+    cmd = build_pipe_command(working_album, track)
+    metrics.record_subprocess(cmd)
+    with subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
+        errors = []
+        drain = threading.Thread(target=lambda: errors.append(p.stderr.read()), daemon=True)
+        drain.start()
+
+        def check_exit():
+            drain.join()
+            if p.wait() != 0:
+                raise RuntimeError('ffmpeg failed to stream track ' + track.number + ':\n' +
+                                   b''.join(errors).decode('utf-8', 'replace'))
+
+        def iter_output():
+            for chunk in iter(functools.partial(p.stdout.read, COPY_CHUNK_SIZE), b''):
+                yield chunk
+            check_exit()
+
+        yield ChunkReader(iter_output())
+        p.stdout.close()
+        check_exit()
+
+
+class ArchiveWriter(object):
+    """Adds members to a zip or tar archive written front to back to sink, which doesn't need to be seekable"""
+
+    def __init__(self, sink, archive_format):
+
+        self.archive_format = archive_format
+        self.timestamp = time.time()
+        self.member_open = False
+        if archive_format == 'zip':
+            self.archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        elif archive_format == 'tar':
+            self.archive = tarfile.open(fileobj=sink, mode='w|', format=tarfile.PAX_FORMAT)
+        else:
+            raise ValueError('archive format must be one of ' + ', '.join(ARCHIVE_FORMATS) +
+                             ', received: ' + str(archive_format))
+
+    def add(self, name, reader, size=None):
+        """
+        Copies a member from reader, returns its size
+
+        zip members of unknown size are streamed with a data descriptor after them, tar members of unknown size
+        are spooled first since the tar header comes before the data, in memory up to ARCHIVE_SPOOL_SIZE
+        """
+
+        if self.archive_format == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime(self.timestamp)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            if size is not None:
+                info.file_size = size
+            with self.archive.open(info, 'w', force_zip64=size is None) as member:
+                copied = 0
+                for chunk in iter(functools.partial(reader.read, COPY_CHUNK_SIZE), b''):
+                    member.write(chunk)
+                    copied += len(chunk)
+            return copied
+
+        if size is not None:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = self.timestamp
+            self.member_open = True
+            self.archive.addfile(info, reader)
+            self.member_open = False
+            return size
+        with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as spool:
+            shutil.copyfileobj(reader, spool, COPY_CHUNK_SIZE)
+            size = spool.tell()
+            spool.seek(0)
+            return self.add(name, spool, size)
+
+    def close(self):
+        self.archive.close()
+
+    def abandon(self):
+        """Drops the archive without writing its end, sink is left holding an archive readers reject as truncated"""
+
+        # both only write the end of the archive from close, which they also call when they're collected,
+        # a zip is unreadable without its central directory, but a tar stream that stops between members reads
+        # as a complete archive, so unless a member was cut off midway a header is added whose data never comes
+        if self.archive_format == 'tar':
+            if not self.member_open:
+                info = tarfile.TarInfo(ARCHIVE_INCOMPLETE_NAME)
+                info.size = tarfile.BLOCKSIZE
+                info.mtime = self.timestamp
+                self.archive.fileobj.write(info.tobuf(tarfile.PAX_FORMAT))
+            self.archive.fileobj.close()
+            self.archive.closed = True
+        else:
+            self.archive.fp = None
+        self.archive = None
+
+
+@timed_stage
+def archive_tracks(working_album, sink, archive_format='zip', include_cue=False, engine='auto'):
+    """
+    Streams every track of an Album into a zip or tar archive written to sink, nothing is written to the split directory
+
+    sink is any binary file object with a write method, an open file or sys.stdout.buffer
+    the native engine copies each track straight out of the memory mapped source, the ffmpeg engine
+    pipes each track out of its own ffmpeg instance, 'auto' picks native whenever it can split the album
+    with include_cue the album's cue sheet goes in first, named like write_cue names it
+    returns the list of member names in the order they were written
+    if a track fails the archive is left unfinished, a zip without its central directory or a tar stream that
+    ends partway through a member, which zip and tar readers both fail on, and the error is raised,
+    sink has to be discarded, see write_archive for a file that only appears once it's complete
+    """
+
+    if engine not in ARCHIVE_ENGINES:
+        raise ValueError('engine must be one of ' + ', '.join(ARCHIVE_ENGINES) + ', received: ' + str(engine))
+    if engine == 'auto':
+        engine = 'native' if native_split_supported(working_album) else 'ffmpeg'
+
+    writer = ArchiveWriter(sink, archive_format)
+    names = []
+
+    def add(name, reader, size, number=None):
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+        metrics.record_bytes(writer.add(name, reader, size))
+        if number is not None:
+            metrics.record_track(number, time.perf_counter() - start, engine, name,
+                                 cpu=time.thread_time() - start_cpu)
+        names.append(name)
+
+    try:
+        if include_cue:
+            cue = io.BytesIO()
+            write_cue_to(working_album, cue, encoding='utf-8')
+            cue_size = cue.tell()
+            cue.seek(0)
+            add(working_album.album_title + '.cue', cue, cue_size)
+
+        if engine == 'native':
+            with open(working_album.audio_file_path, 'rb') as source:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as source_data:
+                    plan = plan_native_split(working_album, source_data, '.')
+                    if plan is None:
+                        raise ValueError('the native engine only splits uncompressed WAVE and AIFF files and mp3 '
+                                         'files, received: ' + working_album.audio_file_path)
+                    for track, track_path, header, offset, length, trailer in plan:
+                        reader = ChunkReader(iter_native_track(source_data, header, offset, length, trailer),
+                                             len(header) + length + len(trailer))
+                        add(os.path.basename(track_path), reader, reader.size, track.number)
+        else:
+            for track in working_album.tracklist_data:
+                with open_pipe_track(working_album, track) as reader:
+                    add(get_track_filename(working_album, track), reader, None, track.number)
+    except BaseException:
+        # closing would write the end of the archive behind a truncated member
+        writer.abandon()
+        raise
+    writer.close()
+
+    return names
+
+
+def write_archive(working_album, output_path, archive_format='zip', include_cue=False, engine='auto'):
+    """
+    Writes the archive_tracks archive of an Album to output_path, returns the list of member names
+
+    the archive is written to a temporary file beside output_path that only replaces it once the archive is complete,
+    if a track fails the temporary file is removed and output_path is left as it was
+    """
+
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            names = archive_tracks(working_album, f, archive_format, include_cue, engine)
+        os.replace(temporary_path, output_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return names
+
+
+def verify_track(working_album, track, split_output_directory, manifest_entries, tolerance=VERIFY_TOLERANCE):
+    """
+    Checks a single split track, returns a dict of its checksums, durations and status
+
+    the status is 'missing' or 'empty' for a missing or empty output, 'corrupt' if its content no longer matches the
+    hash the split manifest recorded although its size and mtime do, 'duration' if its duration is more than
+    tolerance seconds off the tracklist length, 'unknown' if its duration couldn't be read and 'ok' otherwise
+    """
+
+    filename = get_track_filename(working_album, track)
+    output_path = split_output_directory + '/' + filename
+    result = {'number': track.number, 'file': filename, 'expected': round(track.length, 3)}
+
+    try:
+        stat = os.stat(output_path)
+    except OSError:
+        result['status'] = 'missing'
+        return result
+    result['size'], result['sha1'], result['crc32'] = checksum_file(output_path)
+    if not result['size']:
+        result['status'] = 'empty'
+        return result
+
+    manifest_entry = manifest_entries.get(filename)
+    if (manifest_entry is not None and manifest_entry.get('sha1') and manifest_entry['size'] == stat.st_size and
+            manifest_entry['mtime_ns'] == stat.st_mtime_ns and manifest_entry['sha1'] != result['sha1']):
+        result['status'] = 'corrupt'
+        return result
+
+    try:
+        duration = native_duration(output_path)
+        if duration is None:
+            duration = ffprobe_duration(output_path)
+    except (OSError, ValueError):
+        duration = None
+    if duration is None:
+        result['duration'] = None
+        result['status'] = 'unknown'
+        return result
+    result['duration'] = round(duration, 3)
+    result['status'] = 'duration' if abs(duration - track.length) > tolerance else 'ok'
+    return result
+
+
+def build_verify_report(working_album, track_results):
+    """Sums up the verify_track results of an album into the report verify mode writes"""
+
+    counts = {}
+    for track_result in track_results:
+        counts[track_result['status']] = counts.get(track_result['status'], 0) + 1
+    return {'audio': os.path.abspath(working_album.audio_file_path), 'verified': time.time(),
+            'ok': not any(status in VERIFY_FAILURES for status in counts), 'counts': counts, 'tracks': track_results}
+
+
+@timed_stage
+def verify_albums(albums, jobs=None, tolerance=VERIFY_TOLERANCE, printer=print):
+    """
+    Verifies the split tracks of every (audio_file_path, tracklist_path) in albums, see verify_track
+
+    every track of every album is checked on one pool of jobs threads, so a library audit is limited by the disks
+    rather than by waiting on one album at a time, jobs defaults to four per core since the threads mostly wait on
+    reads, each album's report is written to VERIFY_REPORT_NAME in its split directory and a line per album is
+    printed through printer
+    returns a tuple of (reports of albums that passed, list of (audio path, report or error) that failed)
+    """
+
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) * 4
+    passed = []
+    failed = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        submitted = []
+        for audio_file_path, tracklist_path in albums:
+            try:
+                working_album = Album(audio_file_path, tracklist_path)
+                tracks = working_album.tracklist_data
+            except Exception as e:
+                failed.append((audio_file_path, e))
+                printer('FAILED ' + audio_file_path + ': ' + str(e))
+                continue
+            split_output_directory = working_album.audio_file_directory + '/split'
+            manifest_entries = dict((entry['file'], entry)
+                                    for entry in load_split_manifest(split_output_directory)['tracks'])
+            futures = [executor.submit(verify_track, working_album, track, split_output_directory, manifest_entries,
+                                       tolerance)
+                       for track in tracks]
+            submitted.append((working_album, split_output_directory, futures))
+
+        for working_album, split_output_directory, futures in submitted:
+            report = build_verify_report(working_album, [future.result() for future in futures])
+            if os.path.isdir(split_output_directory):
+                with open(split_output_directory + '/' + VERIFY_REPORT_NAME, 'w') as f:
+                    json.dump(report, f, separators=(',', ':'))
+            summary = ', '.join('{} {}'.format(count, status) for status, count in sorted(report['counts'].items()))
+            if report['ok']:
+                passed.append(report)
+                printer('OK ' + working_album.audio_file_path + ' (' + summary + ')')
+            else:
+                failed.append((working_album.audio_file_path, report))
+                printer('FAILED ' + working_album.audio_file_path + ' (' + summary + ')')
+
+    return passed, failed
+
+
+def iter_pcm_chunks(audio_file_path, chunk_seconds=10.0):
+    """
+    Streams the audio of a file chunk_seconds at a time as 16 bit samples, never holding more than a chunk
+
+    uncompressed 16 bit WAVE and AIFF files are read straight out of a memory map, anything else is decoded by
+    ffmpeg to mono at DETECT_SAMPLE_RATE and read from its stdout
+    yields tuples of (sample rate, channels, sample format, bytes) where sample format is as in PcmLayout
+    raises RuntimeError if ffmpeg fails to decode the file
+    """
+
+    with open(audio_file_path, 'rb') as f:
+        if f.read(4) in (b'RIFF', b'FORM'):
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                layout = read_pcm_layout(data)
+                if layout is not None and layout.sample_format is not None:
+                    chunk_bytes = max(int(chunk_seconds * layout.sample_rate), 1) * layout.block_align
+                    end = layout.data_offset + layout.frames * layout.block_align
+                    for offset in range(layout.data_offset, end, chunk_bytes):
+                        yield (layout.sample_rate, layout.channels, layout.sample_format,
+                               data[offset:min(end, offset + chunk_bytes)])
+                    return
+
+    cmd = ['ffmpeg', '-v', 'error', '-i', audio_file_path, '-f', 's16le', '-ac', '1',
+           '-ar', str(DETECT_SAMPLE_RATE), '-']
+    metrics.record_subprocess(cmd)
+    chunk_bytes = int(chunk_seconds * DETECT_SAMPLE_RATE) * 2
+    # stderr goes to a file so a chatty ffmpeg can't fill the pipe and stall while stdout is being read
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                chunk = process.stdout.read(chunk_bytes)
+                if not chunk:
+                    break
+                yield DETECT_SAMPLE_RATE, 1, '<i2', chunk
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            raise RuntimeError('ffmpeg failed to decode ' + audio_file_path + ': ' +
+                               errors.read().decode('utf-8', 'replace').strip())
+
+
+def iter_window_levels(chunks, window_seconds=DETECT_WINDOW_SECONDS):
+    """
+    Turns the chunks of iter_pcm_chunks into the loudness of every window_seconds of audio
+
+    yields tuples of (window start in seconds, RMS level in dBFS), digital silence measures about -90 dBFS
+    windows are measured with numpy when it is installed, otherwise DETECT_FALLBACK_WINDOW_SAMPLES evenly spaced
+    samples of each window are measured in pure python
+    """
+
+    carry = b''
+    window_number = 0
+    for sample_rate, channels, sample_format, chunk in chunks:
+        window_frames = max(int(round(window_seconds * sample_rate)), 1)
+        window_samples = window_frames * channels
+        # windows can straddle chunks, the unmeasured tail is carried over to the next chunk
+        data = carry + chunk
+        usable = len(data) - len(data) % (window_samples * 2)
+        carry = data[usable:]
+        if not usable:
+            continue
+
+        if numpy is not None:
+            samples = numpy.frombuffer(data, dtype=sample_format, count=usable // 2).astype(numpy.float64)
+            power = (samples * samples).reshape(-1, window_samples).mean(axis=1)
+            levels = (20 * numpy.log10(numpy.maximum(numpy.sqrt(power), 1.0) / 32768.0)).tolist()
+        else:
+            samples = array.array('h')
+            samples.frombytes(data[:usable])
+            if (sample_format[0] == '<') != (sys.byteorder == 'little'):
+                samples.byteswap()
+            stride = max(window_samples // DETECT_FALLBACK_WINDOW_SAMPLES, 1)
+            levels = []
+            for start in range(0, len(samples), window_samples):
+                window = samples[start:start + window_samples:stride]
+                power = sum(map(operator.mul, window, window)) / len(window)
+                levels.append(20 * math.log10(max(math.sqrt(power), 1.0) / 32768.0))
+
+        for level in levels:
+            yield window_number * window_frames / sample_rate, level
+            window_number += 1
+
+
+def iter_silence_boundaries(levels, threshold_db=DETECT_THRESHOLD_DB, min_silence=DETECT_MIN_SILENCE,
+                            min_track_length=DETECT_MIN_TRACK_LENGTH):
+    """
+    Yields the seconds at which new tracks start, given the levels of iter_window_levels
+
+    a boundary is the middle of a run of windows quieter than threshold_db lasting at least min_silence seconds,
+    silence before the first sound and after the last doesn't start a track, neither does a run ending less than
+    min_track_length after the previous boundary, so a quiet passage mid track isn't mistaken for a gap
+    """
+
+    previous_boundary = 0.0
+    silence_start = None
+    heard_sound = False
+    for start, level in levels:
+        if level < threshold_db:
+            if silence_start is None:
+                silence_start = start
+            continue
+        if silence_start is not None and heard_sound and start - silence_start >= min_silence:
+            boundary = (silence_start + start) / 2
+            if boundary - previous_boundary >= min_track_length:
+                yield boundary
+                previous_boundary = boundary
+        silence_start = None
+        heard_sound = True
+
+
+@timed_stage
+def detect_tracklist(audio_file_path, sink, threshold_db=DETECT_THRESHOLD_DB, min_silence=DETECT_MIN_SILENCE,
+                     min_track_length=DETECT_MIN_TRACK_LENGTH, artist='Unknown Artist'):
+    """
+    Proposes a tracklist from the silences in an audio file and writes it to sink as tracklist csv rows
+
+    the rows are in the usual Track#,Artist,Track Title,Track Index format with placeholder artists and titles,
+    so the proposal can be edited and fed straight back in, indexes are rounded to whole seconds
+    the audio is streamed, so memory use doesn't grow with the length of the file, see iter_pcm_chunks
+    returns the list of track indexes in seconds
+    """
+
+    writer = csv.writer(sink, lineterminator='\n')
+    indexes = [0]
+    writer.writerow(['1', artist, 'Track 1', get_hms(0)])
+    levels = iter_window_levels(iter_pcm_chunks(audio_file_path))
+    for boundary in iter_silence_boundaries(levels, threshold_db, min_silence, min_track_length):
+        index = int(round(boundary))
+        if index <= indexes[-1]:
+            continue
+        indexes.append(index)
+        writer.writerow([str(len(indexes)), artist, 'Track ' + str(len(indexes)), get_hms(index)])
+    return indexes
+
+
+def yes_no_decision(prompt_text, inputter=input):
+    """Asks user a question, returns answer as boolean, by default it uses input(), can be defined for unit testing"""
+
+    print('')
+    user_input = inputter('{} [y/n]:'.format(prompt_text))
+    print('')
+    if user_input:
+        if user_input[0].lower() == 'y':
+            return True
+        else:
+            return False
+    else:
+        return False
+
+
+def get_user_input(prompt_text, inputter=input):
+    """separate input function to help with testing"""
+
+    return inputter(prompt_text)
+
+
+def enter_to_continue(inputter=input):
+    """Simple press enter to continue"""
+
+    print('')
+    inputter('Press enter to continue...')
+    print('')
+
+
+# TODO TESTS
+def generate(audio_file_path, tracklist_path=None, verbose=False, jobs=None, engine='auto', use_cache=True):
+    """
+    The generate function, generates a .cue file from a .csv and audio file.
+
+    audio_file_path should be a path to an audio file
+
+    tracklist_path should be a path to a valid .csv file
+
+    create_cue determines whether a .cue file is generated
+
+    do_split_tracks determines whether the original audio file is split into separate tracks
+
+    jobs is the number of tracks split at once, defaults to the number of cores
+
+    engine selects how the tracks are split, see split_tracks
+
+    use_cache=False probes the audio file even if its duration is cached
+
+    the cue file is generated in the same directory as the audio file
+    the split tracks are generated in a 'split/' subdirectory of the audio file
+    """
+    # TODO change the CSV format to start with Track# THEN Track Index followed by Artist,Track Title
+    # TODO make some nicer error messages if referenced files don't exist
+    # TODO choose custom outputs for cue and split tracks...
+
+    working_album = Album(audio_file_path, tracklist_path, use_cache=use_cache)
+
+    output_file = working_album.album_title + '.cue'
+
+    if verbose:
+        working_album.album_performer = get_user_input('Album performer:')
+        if yes_no_decision('Review album data?'):
+            review_album(working_album)
+        if yes_no_decision('Create .cue file?'):
+            write_cue(working_album, output_file)
+        if yes_no_decision('Split tracks?'):
+            split_tracks(working_album, jobs=jobs, engine=engine)
+    else:
+        working_album.album_performer = "Various Artists"
+        review_album(working_album)
+        write_cue(working_album, output_file)
+        split_tracks(working_album, jobs=jobs, engine=engine)
+
+    enter_to_continue()
+
+
+def silent_printer(*args, **kwargs):
+    """Drop in replacement for print() that discards everything, used by the headless functions"""
+
+    pass
+
+
+class GenerateResult(object):
+    """
+    The outcome of process_album
+
+    steps maps each step ('album', 'cue', 'split') to 'done', 'skipped' or 'failed'
+    errors maps each failed step to the exception it raised
+    progress, if given, is called with the step and its status whenever a step finishes or fails
+    a cue only run never probes the audio, so total_duration_seconds and the last track's length stay None
+    unless the duration was passed in
+    """
+
+    def __init__(self, audio_file_path, progress=None):
+
+        self.audio_file_path = audio_file_path
+        self.progress = progress
+        self.total_duration_seconds = None
+        self.track_durations = []
+        self.cue_path = None
+        self.track_paths = []
+        self.steps = {'album': 'skipped', 'cue': 'skipped', 'split': 'skipped'}
+        self.errors = {}
+
+    @property
+    def ok(self):
+        """True if no step failed"""
+
+        return not self.errors
+
+    def finish(self, step):
+        self.steps[step] = 'done'
+        if self.progress is not None:
+            self.progress(step, 'done')
+
+    def fail(self, step, error):
+        self.steps[step] = 'failed'
+        self.errors[step] = error
+        if self.progress is not None:
+            self.progress(step, 'failed')
+
+    def as_dict(self):
+        """Returns the result as a dict of json types, errors become their messages"""
+
+        return {'audio': self.audio_file_path, 'ok': self.ok, 'steps': dict(self.steps),
+                'errors': dict((step, str(error)) for step, error in self.errors.items()),
+                'cue_path': self.cue_path, 'track_paths': list(self.track_paths),
+                'total_duration_seconds': self.total_duration_seconds,
+                'track_durations': [list(track_duration) for track_duration in self.track_durations]}
+
+
+def record_album(result, working_album):
+    """Fills in the album step of a GenerateResult, the durations are only recorded if they are already known"""
+
+    if working_album.duration_known:
+        result.total_duration_seconds = working_album.total_duration_seconds
+    result.track_durations = [(track.number, track.length) for track in working_album.tracks]
+    result.finish('album')
+
+
+def process_album(audio_file_path, tracklist_path=None, album_performer='Various Artists', create_cue=True,
+                  split=True, jobs=None, engine='auto', use_cache=True, total_duration_seconds=None, progress=None):
+    """
+    Headless counterpart of generate() for embedding ECU in job runners
+
+    builds the Album, writes the cue file and splits the tracks without ever prompting, printing or exiting,
+    every step's failure is caught and recorded, returns a GenerateResult
+    create_cue and split choose the steps, the rest of the arguments are passed on to Album and split_tracks
+    progress is called with the step and its status as each step finishes
+    """
+
+    result = GenerateResult(audio_file_path, progress=progress)
+
+    try:
+        working_album = Album(audio_file_path, tracklist_path, total_duration_seconds=total_duration_seconds,
+                              use_cache=use_cache)
+        # a cue file only needs the tracklist, the audio file is only probed when the tracks are split
+        working_album.load_tracks(probe=split)
+    except Exception as e:
+        result.fail('album', e)
+        return result
+    working_album.album_performer = album_performer
+    record_album(result, working_album)
+
+    if create_cue:
+        try:
+            result.cue_path = write_cue(working_album, working_album.album_title + '.cue', printer=silent_printer)
+            result.finish('cue')
+        except Exception as e:
+            result.fail('cue', e)
+
+    if split:
+        try:
+            result.track_paths = split_tracks(working_album, jobs=jobs, engine=engine, printer=silent_printer)
+            result.finish('split')
+        except Exception as e:
+            result.fail('split', e)
+
+    return result
+
+
+async def async_run_ffmpeg(cmd, timeout=None):
+    """
+    asyncio counterpart of run_ffmpeg, returns a tuple of (exit status, combined output)
+
+    if timeout seconds pass, or the task is cancelled, the process is killed before the error is raised
+    """
+
+    metrics.record_subprocess(cmd)
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        output = (await asyncio.wait_for(p.communicate(), timeout))[0]
+    except BaseException:
+        if p.returncode is None:
+            p.kill()
+            await p.wait()
+        raise
+    return p.returncode, output.decode('utf-8', errors='replace')
+
+
+async def async_probe_duration(audio_file_path, use_cache=True, timeout=None):
+    """
+    asyncio counterpart of probe_duration
+
+    the cache and header reads run on the default executor, ffprobe runs as an asyncio subprocess
+    """
+
+    loop = asyncio.get_running_loop()
+
+    if use_cache:
+        total_duration_seconds = await loop.run_in_executor(None, duration_cache.lookup, audio_file_path)
+        if total_duration_seconds is not None:
+            return total_duration_seconds
+
+    total_duration_seconds = await loop.run_in_executor(None, native_duration, audio_file_path)
+    if total_duration_seconds is None:
+        returncode, output = await async_run_ffmpeg(build_ffprobe_command(audio_file_path), timeout)
+        total_duration_seconds = parse_ffprobe_duration(audio_file_path, returncode, output)
+
+    if use_cache:
+        await loop.run_in_executor(None, duration_cache.store, audio_file_path, total_duration_seconds)
+    return total_duration_seconds
+
+
+async def async_split_tracks(working_album, jobs=None, engine='auto', semaphore=None, timeout=None, incremental=True):
+    """
+    asyncio counterpart of split_tracks, returns the paths of the split tracks in tracklist order
+
+    every ffmpeg instance holds semaphore while it runs, pass the same semaphore to every album to cap the
+    number of ffmpeg instances across all of them, by default each call gets its own semaphore of jobs
+    timeout applies to each ffmpeg instance, raises RuntimeError if any track could not be split
+    """
+
+    jobs, split_output_directory, track_paths = prepare_split(working_album, jobs, engine)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(jobs)
+    loop = asyncio.get_running_loop()
+    engine = await loop.run_in_executor(None, resolve_split_engine, working_album, engine)
+
+    pending_album = working_album
+    if incremental:
+        pending_album, engine = await loop.run_in_executor(None, reconcile_split, working_album,
+                                                           split_output_directory, engine)
+    if pending_album is not None:
+        await async_run_split_engine(pending_album, split_output_directory, jobs, engine, semaphore, timeout)
+
+    await loop.run_in_executor(None, write_split_manifest, working_album, split_output_directory, engine, jobs)
+    return track_paths
+
+
+async def async_run_split_engine(working_album, split_output_directory, jobs, engine, semaphore, timeout):
+    """asyncio counterpart of run_split_engine"""
+
+    loop = asyncio.get_running_loop()
+
+    if engine == 'native':
+        async with semaphore:
+            await loop.run_in_executor(None, split_tracks_native, working_album, split_output_directory, jobs)
+        return
+
+    if engine == 'segment':
+        segment_pattern = build_segment_pattern(working_album, split_output_directory)
+        async with semaphore:
+            returncode, output = await async_run_ffmpeg(build_segment_command(working_album, segment_pattern), timeout)
+        if collect_segments(working_album, split_output_directory, returncode):
+            return
+
+    async def split_track(track):
+        cmd = build_split_command(working_album, track, split_output_directory)
+        async with semaphore:
+            start = time.perf_counter()
+            returncode, output = await async_run_ffmpeg(cmd, timeout)
+        metrics.record_track(track.number, time.perf_counter() - start, 'per-track', cmd[-1], returncode)
+        return returncode
+
+    # a timeout or cancellation of one track cancels the rest, which kills their ffmpeg instances
+    tasks = [asyncio.ensure_future(split_track(track)) for track in working_album.tracklist_data]
+    try:
+        returncodes = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    failed_tracks = [track.number for track, returncode in zip(working_album.tracklist_data, returncodes)
+                     if returncode != 0]
+    if failed_tracks:
+        raise RuntimeError('ffmpeg failed to split track(s): ' + ', '.join(failed_tracks))
+
+
+async def async_generate(audio_file_path, tracklist_path=None, album_performer='Various Artists', create_cue=True,
+                         split=True, jobs=None, engine='auto', use_cache=True, semaphore=None, timeout=None):
+    """
+    asyncio counterpart of process_album, returns a GenerateResult
+
+    semaphore and timeout are passed on to async_split_tracks, probing holds semaphore too
+    step failures are recorded in the result, cancellation is not caught
+    """
+
+    result = GenerateResult(audio_file_path)
+    loop = asyncio.get_running_loop()
+
+    try:
+        # a cue file only needs the tracklist, the audio file is only probed when the tracks are split
+        total_duration_seconds = None
+        if split and semaphore is None:
+            total_duration_seconds = await async_probe_duration(audio_file_path, use_cache, timeout)
+        elif split:
+            async with semaphore:
+                total_duration_seconds = await async_probe_duration(audio_file_path, use_cache, timeout)
+        working_album = Album(audio_file_path, tracklist_path, total_duration_seconds, use_cache)
+        await loop.run_in_executor(None, lambda: working_album.tracks)
+    except Exception as e:
+        result.fail('album', e)
+        return result
+    working_album.album_performer = album_performer
+    record_album(result, working_album)
+
+    if create_cue:
+        try:
+            result.cue_path = await loop.run_in_executor(None, functools.partial(
+                write_cue, working_album, working_album.album_title + '.cue', printer=silent_printer))
+            result.finish('cue')
+        except Exception as e:
+            result.fail('cue', e)
+
+    if split:
+        try:
+            result.track_paths = await async_split_tracks(working_album, jobs=jobs, engine=engine,
+                                                          semaphore=semaphore, timeout=timeout)
+            result.finish('split')
+        except Exception as e:
+            result.fail('split', e)
+
+    return result
+
+
+def discover_albums(path, printer=print):
+    """
+    Finds the albums batch mode should process, returns a list of (audio_file_path, tracklist_path) tuples
+
+    path can be a directory tree or a list file
+    in a directory tree every directory holding a tracklist.csv and exactly one audio file is an album,
+    the tracklist_path is None so Album loads tracklist.csv from beside the audio the way it always does
+    a list file is a csv of audio_file_path[,tracklist_path] rows, relative paths are relative to the list file
+    skipped directories are reported through printer
+    """
+
+    albums = []
+
+    if os.path.isdir(path):
+        for directory, subdirectories, filenames in os.walk(path):
+            subdirectories.sort()
+            if 'tracklist.csv' not in filenames:
+                continue
+            audio_files = sorted(name for name in filenames if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+            if len(audio_files) == 1:
+                albums.append((directory + '/' + audio_files[0], None))
+            else:
+                printer('Skipping ' + directory + ', expected 1 audio file, found ' + str(len(audio_files)))
+    else:
+        list_file_directory = os.path.dirname(path)
+        with open(path, 'r') as f:
+            for row in csv.reader(f):
+                if not row or not row[0].strip():
+                    continue
+                audio_file_path = os.path.join(list_file_directory, row[0].strip())
+                if len(row) > 1 and row[1].strip():
+                    tracklist_path = os.path.join(list_file_directory, row[1].strip())
+                else:
+                    tracklist_path = None
+                albums.append((audio_file_path, tracklist_path))
+
+    return albums
+
+
+class Catalog(object):
+    """
+    SQLite database of every album ECU has seen and its tracks, so a library can be searched and batch runs can
+    tell which albums are already done without probing them
+
+    an album is recorded with the signature of its audio file and tracklist, see album_signature, and only counts
+    as processed while that signature still matches
+    the database is catalog.sqlite in $ECU_CACHE_DIR or ~/.cache/ecu by default, opened in WAL mode so searches
+    aren't blocked by a batch recording albums
+    """
+
+    def __init__(self, catalog_path=None):
+
+        if catalog_path is None:
+            catalog_path = os.path.join(get_cache_directory(), 'catalog.sqlite')
+        catalog_directory = os.path.dirname(os.path.abspath(catalog_path))
+        if not os.path.exists(catalog_directory):
+            os.makedirs(catalog_directory, exist_ok=True)
+        self.catalog_path = catalog_path
+        self.connection = sqlite3.connect(catalog_path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(CATALOG_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, working_album, signature, cue_path=None, track_paths=None, processed=None):
+        """
+        Records an Album and its tracks, replacing what was recorded for its audio file before, returns its id
+
+        track_paths are the split outputs in tracklist order, processed is when it was processed, None if it was
+        only imported, importing an album again leaves it processed as long as its signature hasn't changed
+        the album's tracks are read without probing so its duration is only recorded if it's known
+        the caller commits, see record_albums
+        """
+
+        duration = working_album.total_duration_seconds if working_album.duration_known else None
+        row = (os.path.abspath(working_album.audio_file_path), os.path.abspath(working_album.tracklist_path)) + \
+            tuple(signature) + (duration, working_album.cue_extension,
+                                None if cue_path is None else os.path.abspath(cue_path), bool(track_paths), processed)
+        # an import of an album that hasn't changed since it was processed keeps it processed
+        kept = ('(excluded.processed IS NULL AND albums.size IS excluded.size AND albums.mtime_ns IS excluded.mtime_ns '
+                'AND albums.tracklist_size IS excluded.tracklist_size '
+                'AND albums.tracklist_mtime_ns IS excluded.tracklist_mtime_ns)')
+        self.connection.execute(
+            'INSERT INTO albums (path, tracklist_path, size, mtime_ns, tracklist_size, tracklist_mtime_ns, duration, '
+            'cue_extension, cue_path, split, processed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET tracklist_path = excluded.tracklist_path, size = excluded.size, '
+            'mtime_ns = excluded.mtime_ns, tracklist_size = excluded.tracklist_size, '
+            'tracklist_mtime_ns = excluded.tracklist_mtime_ns, '
+            'duration = excluded.duration, cue_extension = excluded.cue_extension, '
+            'cue_path = CASE WHEN ' + kept + ' THEN coalesce(excluded.cue_path, albums.cue_path) '
+            'ELSE excluded.cue_path END, '
+            'split = CASE WHEN ' + kept + ' THEN max(albums.split, excluded.split) ELSE excluded.split END, '
+            'processed = CASE WHEN ' + kept + ' THEN albums.processed ELSE excluded.processed END', row)
+        album_id = self.connection.execute('SELECT id FROM albums WHERE path = ?', row[:1]).fetchone()[0]
+
+        tracks = working_album.tracks
+        if not track_paths:
+            track_paths = [None] * len(tracks)
+        self.connection.execute('DELETE FROM tracks WHERE album_id = ?', (album_id,))
+        self.connection.executemany(
+            'INSERT INTO tracks (album_id, number, artist, title, start, length, output_path) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(album_id, track.number, track.artist, track.title, track.index, track.length,
+              None if track_path is None else os.path.abspath(track_path))
+             for track, track_path in zip(tracks, track_paths)])
+        return album_id
+
+    def record_albums(self, entries):
+        """Records every (working_album, signature, cue_path, track_paths, processed) of entries in one transaction"""
+
+        with self.connection:
+            for entry in entries:
+                self.record(*entry)
+
+    def processed_albums(self, albums, split=True):
+        """
+        Returns the set of audio paths of albums, a list of (audio_file_path, signature), that were processed
+        with the same signature, with split only counting albums whose tracks were split as well
+
+        answered by a single indexed join rather than a query per album
+        """
+
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (path TEXT, size INTEGER, mtime_ns INTEGER, '
+                                'tracklist_size INTEGER, tracklist_mtime_ns INTEGER)')
+        with self.connection:
+            self.connection.execute('DELETE FROM wanted')
+            self.connection.executemany('INSERT INTO wanted VALUES (?, ?, ?, ?, ?)',
+                                        [(os.path.abspath(audio_file_path),) + tuple(signature)
+                                         for audio_file_path, signature in albums if signature is not None])
+            rows = self.connection.execute(
+                'SELECT wanted.path FROM wanted JOIN albums ON albums.path = wanted.path '
+                'AND albums.size = wanted.size AND albums.mtime_ns = wanted.mtime_ns '
+                'AND albums.tracklist_size = wanted.tracklist_size '
+                'AND albums.tracklist_mtime_ns = wanted.tracklist_mtime_ns '
+                'WHERE albums.processed IS NOT NULL AND (albums.split OR NOT ?)', (split,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def find_album(self, audio_file_path):
+        """Returns the recorded album of audio_file_path as a dict with a list of its tracks, or None"""
+
+        album = self.connection.execute('SELECT * FROM albums WHERE path = ?',
+                                        (os.path.abspath(audio_file_path),)).fetchone()
+        if album is None:
+            return None
+        album = dict(album)
+        album['tracks'] = [dict(track) for track in self.connection.execute(
+            'SELECT number, artist, title, start, length, output_path FROM tracks WHERE album_id = ? ORDER BY rowid',
+            (album.pop('id'),))]
+        return album
+
+    def find_tracks(self, artist=None, title=None, output_path=None):
+        """
+        Returns the recorded tracks matching every given field as a list of dicts, each with its album's path
+
+        artist and title match whole names ignoring case, output_path is a split output file
+        """
+
+        conditions = []
+        parameters = []
+        if artist is not None:
+            conditions.append('tracks.artist = ? COLLATE NOCASE')
+            parameters.append(artist)
+        if title is not None:
+            conditions.append('tracks.title = ? COLLATE NOCASE')
+            parameters.append(title)
+        if output_path is not None:
+            conditions.append('tracks.output_path = ?')
+            parameters.append(os.path.abspath(output_path))
+        query = ('SELECT albums.path AS album, tracks.number, tracks.artist, tracks.title, tracks.start, '
+                 'tracks.length, tracks.output_path FROM tracks JOIN albums ON albums.id = tracks.album_id')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return [dict(row) for row in self.connection.execute(query + ' ORDER BY albums.path, tracks.rowid',
+                                                             parameters)]
+
+
+def import_albums(path, catalog, workers=None, use_cache=True, printer=print):
+    """
+    Records every album found under path in catalog without processing it, see discover_albums
+
+    durations are probed on a pool of workers processes the way batch mode probes them, an album that can't be
+    probed is recorded without its duration, split outputs already on disk are recorded as the tracks' outputs
+    the whole import is a single transaction, returns the number of albums recorded
+    """
+
+    albums = discover_albums(path, printer=printer)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        probe_futures = [executor.submit(batch_probe, audio_file_path, use_cache)
+                         for audio_file_path, tracklist_path in albums]
+        entries = []
+        probed = []
+        for (audio_file_path, tracklist_path), future in zip(albums, probe_futures):
+            signature = album_signature(audio_file_path, tracklist_path)
+            try:
+                total_duration_seconds, cache_hit = future.result()
+            except Exception as e:
+                printer('Not probed ' + audio_file_path + ': ' + str(e))
+                total_duration_seconds = None
+            else:
+                if use_cache and not cache_hit:
+                    probed.append((audio_file_path, total_duration_seconds))
+            try:
+                working_album = Album(audio_file_path, tracklist_path, total_duration_seconds=total_duration_seconds)
+                working_album.load_tracks()
+            except Exception as e:
+                printer('Skipping ' + audio_file_path + ': ' + str(e))
+                continue
+            if signature is None:
+                continue
+            split_output_directory = working_album.audio_file_directory + '/split'
+            track_paths = [split_output_directory + '/' + get_track_filename(working_album, track)
+                           for track in working_album.tracks]
+            if not all(os.path.exists(track_path) for track_path in track_paths):
+                track_paths = None
+            cue_path = working_album.audio_file_directory + '/' + working_album.album_title + '.cue'
+            entries.append((working_album, signature, cue_path if os.path.exists(cue_path) else None, track_paths))
+
+    store_probed_durations(probed)
+    catalog.record_albums(entries)
+    printer('Imported {} of {} albums into {}'.format(len(entries), len(albums), catalog.catalog_path))
+    return len(entries)
+
+
+def batch_probe(audio_file_path, use_cache=True):
+    """
+    Batch mode worker, probes a single audio file, kept at module level so the process pool can pickle it
+
+    returns a tuple of (duration, whether it came from the duration cache), a probed duration isn't stored, the
+    worker processes exit without writing out the cache, so the batch stores it with store_probed_durations
+    """
+
+    if use_cache:
+        total_duration_seconds = duration_cache.lookup(audio_file_path)
+        if total_duration_seconds is not None:
+            return total_duration_seconds, True
+    return probe_duration(audio_file_path, use_cache=False), False
+
+
+def store_probed_durations(probed):
+    """Stores the (audio path, duration) pairs batch_probe probed in the duration cache and writes it out once"""
+
+    for audio_file_path, total_duration_seconds in probed:
+        try:
+            duration_cache.store(audio_file_path, total_duration_seconds)
+        except OSError:
+            # the file went away since it was probed
+            pass
+    duration_cache.flush()
+
+
+def batch_process_album(audio_file_path, tracklist_path, total_duration_seconds, split=True, jobs=1,
+                        engine='auto'):
+    """
+    Batch mode worker, writes the cue file and splits the tracks of a single album with process_album
+
+    raises the error of the first failed step back to the batch
+    """
+
+    result = process_album(audio_file_path, tracklist_path, create_cue=True, split=split, jobs=jobs, engine=engine,
+                           total_duration_seconds=total_duration_seconds)
+    # watch mode leaves the probing to the worker, which exits without writing out the cache
+    duration_cache.flush()
+    for step in ('album', 'cue', 'split'):
+        if step in result.errors:
+            raise result.errors[step]
+    return result
+
+
+def batch_generate(path, workers=None, split=True, jobs=1, engine='auto', use_cache=True, catalog_path=None,
+                   reprocess=False):
+    """
+    Generates cue files and split tracks for every album found under path, see discover_albums
+
+    albums are probed, then processed longest first so the long ones don't straggle at the end of the run,
+    without split nothing is probed
+    workers is the number of albums handled at once, defaults to the number of cores
+    jobs and engine are passed on to split_tracks for each album
+    use_cache=False probes every album even if its duration is cached
+    with a catalog_path every processed album is recorded in that Catalog, and albums it already holds as processed
+    are skipped before anything is probed unless reprocess is set
+    prints a summary and returns a tuple of (succeeded audio paths, list of (failed audio path, error))
+    """
+
+    albums = discover_albums(path)
+    succeeded = []
+    failed = []
+    cache_hits = 0
+
+    catalog = None
+    signatures = {}
+    if catalog_path is not None:
+        catalog = Catalog(catalog_path)
+        signatures = dict((audio_file_path, album_signature(audio_file_path, tracklist_path))
+                          for audio_file_path, tracklist_path in albums)
+
+    try:
+        if catalog is not None and not reprocess:
+            processed = catalog.processed_albums(list(signatures.items()), split=split)
+            skipped = len(albums)
+            albums = [album for album in albums if os.path.abspath(album[0]) not in processed]
+            skipped -= len(albums)
+            print('Skipping {} albums already in the catalog'.format(skipped))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+
+            probed_albums = []
+            probed = []
+            if split:
+                # probing is cheap compared to splitting but still a process per file, so it is spread out as well
+                probe_futures = [executor.submit(batch_probe, audio_file_path, use_cache)
+                                 for audio_file_path, tracklist_path in albums]
+                for (audio_file_path, tracklist_path), future in zip(albums, probe_futures):
+                    try:
+                        total_duration_seconds, cache_hit = future.result()
+                    except Exception as e:
+                        failed.append((audio_file_path, e))
+                        continue
+                    probed_albums.append((total_duration_seconds, audio_file_path, tracklist_path))
+                    cache_hits += cache_hit
+                    if use_cache and not cache_hit:
+                        probed.append((audio_file_path, total_duration_seconds))
+                store_probed_durations(probed)
+                probed_albums.sort(key=lambda album: album[0], reverse=True)
+            else:
+                # cue files don't need durations, so a cue only batch is nothing but file reads and writes
+                probed_albums = [(None, audio_file_path, tracklist_path) for audio_file_path, tracklist_path in albums]
+
+            process_futures = {}
+            album_tracklists = dict(albums)
+            for total_duration_seconds, audio_file_path, tracklist_path in probed_albums:
+                future = executor.submit(batch_process_album, audio_file_path, tracklist_path, total_duration_seconds,
+                                         split=split, jobs=jobs, engine=engine)
+                process_futures[future] = audio_file_path
+
+            for future in concurrent.futures.as_completed(process_futures):
+                try:
+                    result = future.result()
+                    succeeded.append(process_futures[future])
+                except Exception as e:
+                    failed.append((process_futures[future], e))
+                    continue
+                if catalog is not None and signatures[result.audio_file_path] is not None:
+                    # the album is done either way, a catalog that can't take it only means it's processed again
+                    try:
+                        working_album = Album(result.audio_file_path, album_tracklists[result.audio_file_path],
+                                              total_duration_seconds=result.total_duration_seconds)
+                        catalog.record_albums([(working_album, signatures[result.audio_file_path], result.cue_path,
+                                                result.track_paths, time.time())])
+                    except Exception as e:
+                        print('Not recorded in the catalog ' + result.audio_file_path + ': ' + str(e))
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    print('')
+    print('Processed {} albums: {} succeeded, {} failed'.format(len(albums), len(succeeded), len(failed)))
+    for audio_file_path, error in failed:
+        print('  FAILED ' + audio_file_path + ': ' + str(error))
+    if use_cache and split:
+        print('Duration cache: {} hits, {} misses'.format(cache_hits, len(albums) - cache_hits))
+    print('')
+
+    return succeeded, failed
+
+
+def album_signature(audio_file_path, tracklist_path):
+    """
+    Returns the size and mtime of an album's audio file and tracklist as a list, or None if either is missing
+
+    the tracklist defaults to tracklist.csv beside the audio file, the same as Album
+    """
+
+    if tracklist_path is None:
+        tracklist_path = os.path.join(os.path.dirname(audio_file_path), 'tracklist.csv')
+    try:
+        audio_stat = os.stat(audio_file_path)
+        tracklist_stat = os.stat(tracklist_path)
+    except OSError:
+        return None
+    return [audio_stat.st_size, audio_stat.st_mtime_ns, tracklist_stat.st_size, tracklist_stat.st_mtime_ns]
+
+
+class WatchQueue(object):
+    """
+    Persistent queue of the albums watch mode has found, so a restart neither loses nor redoes work
+
+    albums are keyed by audio file path and stay pending until a worker finishes them, so albums that were in flight
+    when the daemon stopped are processed again, finished and failed albums are remembered with their signature
+    and only queued again once their audio file or tracklist changes
+    the state is a json file rewritten after every change
+    """
+
+    def __init__(self, state_path):
+
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.done = {}
+        self.failed = {}
+        self.load()
+
+    def load(self):
+        """Reads the state file, a missing or unreadable state file is treated as empty"""
+
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if not isinstance(state, dict):
+            state = {}
+        self.pending = [list(entry) for entry in state.get('pending', [])]
+        self.done = dict(state.get('done', {}))
+        self.failed = dict(state.get('failed', {}))
+
+    def save(self):
+        """Writes the state file, swapped in whole so a crash never leaves half of it"""
+
+        state_directory = os.path.dirname(os.path.abspath(self.state_path))
+        if not os.path.exists(state_directory):
+            os.makedirs(state_directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=state_directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pending': self.pending, 'done': self.done, 'failed': self.failed}, f)
+        os.replace(temporary_path, self.state_path)
+
+    def add(self, audio_file_path, tracklist_path, signature):
+        """Queues an album, returns False if it's already queued or was already handled with the same signature"""
+
+        with self.lock:
+            if self.done.get(audio_file_path) == signature:
+                return False
+            if audio_file_path in self.failed and self.failed[audio_file_path][0] == signature:
+                return False
+            for entry in self.pending:
+                if entry[0] == audio_file_path:
+                    if entry[2] == signature:
+                        return False
+                    entry[1], entry[2] = tracklist_path, signature
+                    break
+            else:
+                self.pending.append([audio_file_path, tracklist_path, signature])
+            self.save()
+            return True
+
+    def pending_albums(self):
+        """Returns a list of (audio_file_path, tracklist_path, signature) in the order they were queued"""
+
+        with self.lock:
+            return [tuple(entry) for entry in self.pending]
+
+    def finish(self, audio_file_path, signature, error=None):
+        """
+        Records the outcome of processing an album, error is None if it succeeded
+
+        if the album changed while it was processed it stays pending under its new signature
+        """
+
+        with self.lock:
+            self.pending = [entry for entry in self.pending
+                            if entry[0] != audio_file_path or entry[2] != signature]
+            if error is None:
+                self.done[audio_file_path] = signature
+                self.failed.pop(audio_file_path, None)
+            else:
+                self.failed[audio_file_path] = [signature, str(error)]
+            self.save()
+
+
+class StabilityTracker(object):
+    """
+    Holds back albums until their files have stopped changing, an album still being copied keeps changing size
+
+    clock is only replaceable for testing
+    """
+
+    def __init__(self, settle, clock=time.monotonic):
+
+        self.settle = settle
+        self.clock = clock
+        self.observed = {}
+
+    def observe(self, albums):
+        """
+        Takes every (audio_file_path, tracklist_path) currently found
+
+        returns a list of (audio_file_path, tracklist_path, signature) of the albums whose signature hasn't changed
+        for settle seconds, albums that disappear are forgotten
+        """
+
+        now = self.clock()
+        observed = {}
+        stable = []
+        for audio_file_path, tracklist_path in albums:
+            signature = album_signature(audio_file_path, tracklist_path)
+            if signature is None:
+                continue
+            previous = self.observed.get(audio_file_path)
+            since = previous[1] if previous is not None and previous[0] == signature else now
+            settled = now - since >= self.settle
+            observed[audio_file_path] = (signature, since, settled)
+            if settled:
+                stable.append((audio_file_path, tracklist_path, signature))
+        self.observed = observed
+        return stable
+
+    def unsettled(self):
+        """Checks whether any album seen by the last observe was still waiting to settle, so it needs observing again"""
+
+        return not all(settled for signature, since, settled in self.observed.values())
+
+
+class DirectoryWatcher(object):
+    """
+    Waits for something to change under the drop directories
+
+    uses inotify when inotify_simple is installed and the platform supports it, otherwise falls back to reporting
+    a change every poll_interval seconds so the caller rescans
+    """
+
+    def __init__(self, directories, poll_interval=2.0):
+
+        self.directories = directories
+        self.poll_interval = poll_interval
+        self.last_poll = time.monotonic()
+        self.watched = set()
+        self.inotify = None
+        if inotify_simple is not None:
+            try:
+                self.inotify = inotify_simple.INotify()
+                self.add_watches()
+            except OSError:
+                self.close()
+
+    def add_watches(self):
+        """Watches every directory under the drop directories that isn't watched yet, inotify isn't recursive"""
+
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.MODIFY
+        for drop_directory in self.directories:
+            for directory, subdirectories, filenames in os.walk(drop_directory):
+                if directory not in self.watched:
+                    self.inotify.add_watch(directory, mask)
+                    self.watched.add(directory)
+
+    def wait(self, timeout, stop_event):
+        """Returns True if something may have changed, after at most timeout seconds or once stop_event is set"""
+
+        if self.inotify is None:
+            stop_event.wait(min(timeout, self.poll_interval))
+            if time.monotonic() - self.last_poll >= self.poll_interval:
+                self.last_poll = time.monotonic()
+                return True
+            return False
+
+        # the read is capped at a second so a stop request is noticed
+        events = self.inotify.read(timeout=int(min(timeout, 1.0) * 1000))
+        if any(event.mask & inotify_simple.flags.ISDIR for event in events):
+            self.add_watches()
+        return bool(events)
+
+    def close(self):
+
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def watch(directories, workers=None, split=True, jobs=1, engine='auto', settle=5.0, poll_interval=2.0,
+          max_in_flight=None, state_path=None, stop_event=None, printer=print):
+    """
+    Processes albums as they land in the drop directories until stop_event is set, see discover_albums
+
+    an album is queued once its audio file and tracklist haven't changed for settle seconds, then handed to a pool
+    of worker processes that run batch_process_album with split, jobs and engine
+    at most max_in_flight albums, by default twice the number of workers, are handed to the pool at once, the rest
+    wait in the persistent queue at state_path, by default watch-queue.json in $ECU_CACHE_DIR or ~/.cache/ecu
+    returns a tuple of (succeeded audio paths, list of (failed audio path, error)) of this run
+    """
+
+    if state_path is None:
+        state_path = os.path.join(get_cache_directory(), 'watch-queue.json')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    queue = WatchQueue(state_path)
+    tracker = StabilityTracker(settle)
+    watcher = DirectoryWatcher(directories, poll_interval)
+    in_flight = {}
+    succeeded = []
+    failed = []
+
+    def collect(future):
+        audio_file_path, signature = in_flight.pop(future)
+        error = future.exception()
+        queue.finish(audio_file_path, signature, error)
+        if error is None:
+            succeeded.append(audio_file_path)
+            printer('Processed ' + audio_file_path)
+        else:
+            failed.append((audio_file_path, error))
+            printer('FAILED ' + audio_file_path + ': ' + str(error))
+
+    if watcher.inotify is not None:
+        printer('Watching ' + ', '.join(directories) + ' with inotify')
+    else:
+        printer('Watching ' + ', '.join(directories) + ', checking every {} seconds'.format(poll_interval))
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            changed = True
+            while not stop_event.is_set():
+                if changed or tracker.unsettled():
+                    albums = []
+                    for directory in directories:
+                        albums.extend(discover_albums(directory, printer=silent_printer))
+                    for audio_file_path, tracklist_path, signature in tracker.observe(albums):
+                        if queue.add(audio_file_path, tracklist_path, signature):
+                            printer('Queued ' + audio_file_path)
+
+                # only max_in_flight albums are handed over, so a flood of new albums waits on disk, not in memory
+                busy = set(audio_file_path for audio_file_path, signature in in_flight.values())
+                for audio_file_path, tracklist_path, signature in queue.pending_albums():
+                    if len(in_flight) >= max_in_flight:
+                        break
+                    if audio_file_path in busy:
+                        continue
+                    future = executor.submit(batch_process_album, audio_file_path, tracklist_path, None,
+                                             split=split, jobs=jobs, engine=engine)
+                    in_flight[future] = (audio_file_path, signature)
+                    busy.add(audio_file_path)
+
+                for future in [future for future in in_flight if future.done()]:
+                    collect(future)
+
+                if in_flight:
+                    timeout = WATCH_BUSY_INTERVAL
+                elif tracker.unsettled():
+                    timeout = settle
+                else:
+                    timeout = poll_interval
+                changed = watcher.wait(timeout, stop_event)
+
+            # albums already handed to the pool are finished so they aren't redone after a restart
+            for future in concurrent.futures.as_completed(list(in_flight)):
+                collect(future)
+    finally:
+        watcher.close()
+
+    return succeeded, failed
+
+
+def get_socket_path():
+    """Returns the unix socket serve mode listens on by default, ecu.sock in the cache directory"""
+
+    return os.path.join(get_cache_directory(), 'ecu.sock')
+
+
+def run_server_job(request, send):
+    """
+    Runs a single serve mode job request with process_album, sending a step event as each step finishes
+
+    the request is a dict of audio, and optionally id, tracklist, performer, cue, split, jobs, engine and use_cache,
+    ends with a result event holding GenerateResult.as_dict, or an error event if the request itself is bad
+    """
+
+    job_id = request.get('id')
+    try:
+        if not isinstance(request.get('audio'), str):
+            raise ValueError('a job needs the path of an audio file as audio')
+
+        def progress(step, status):
+            send({'id': job_id, 'event': 'step', 'step': step, 'status': status})
+
+        result = process_album(request['audio'], request.get('tracklist'),
+                               album_performer=request.get('performer', 'Various Artists'),
+                               create_cue=request.get('cue', True), split=request.get('split', True),
+                               jobs=request.get('jobs'), engine=request.get('engine', 'auto'),
+                               use_cache=request.get('use_cache', True), progress=progress)
+    except Exception as e:
+        send({'id': job_id, 'event': 'error', 'error': str(e)})
+        return
+    message = result.as_dict()
+    message.update({'id': job_id, 'event': 'result'})
+    send(message)
+
+
+class ServerHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one serve mode connection, every line the client sends is a json job request
+
+    jobs are queued on the server's worker pool as they arrive and their events are sent back as json lines,
+    interleaved if the client sent several, the connection stays open until the client stops sending and
+    every job it sent has finished
+    a {"command": "shutdown"} line stops the server once the jobs already queued are done
+    """
+
+    def handle(self):
+
+        write_lock = threading.Lock()
+
+        def send(message):
+            with write_lock:
+                try:
+                    self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+                    self.wfile.flush()
+                except OSError:
+                    # the client went away, its jobs still run to completion
+                    pass
+
+        futures = []
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise ValueError('a request must be a json object')
+            except ValueError as e:
+                send({'id': None, 'event': 'error', 'error': 'bad request: ' + str(e)})
+                continue
+            if request.get('command') == 'shutdown':
+                send({'id': request.get('id'), 'event': 'shutdown'})
+                self.server.stop_event.set()
+                continue
+            send({'id': request.get('id'), 'event': 'queued'})
+            futures.append(self.server.executor.submit(run_server_job, request, send))
+        concurrent.futures.wait(futures)
+
+
+class EcuServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server of serve mode, every connection gets a thread, the jobs share executor"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, executor, stop_event):
+
+        self.executor = executor
+        self.stop_event = stop_event
+        socketserver.UnixStreamServer.__init__(self, socket_path, ServerHandler)
+
+
+def serve(socket_path=None, workers=None, stop_event=None, printer=print):
+    """
+    Keeps a warm ECU process listening on a unix socket, running job requests until stop_event is set
+
+    jobs run on a pool of worker threads, workers defaults to the number of cores, the splitting itself happens in
+    ffmpeg or the kernel so threads don't contend for the interpreter, the duration cache is read once and its
+    new entries written out as they accumulate and on shutdown, and the last MP3_INDEX_MEMORY_FILES mp3 frame
+    indexes stay in memory, so jobs on files seen before don't go back to disk, see ServerHandler for the protocol
+    socket_path defaults to get_socket_path(), the socket is only accessible to the user running the server
+    raises RuntimeError if another server is already listening on socket_path
+    """
+
+    if socket_path is None:
+        socket_path = get_socket_path()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            # left behind by a server that didn't shut down cleanly
+            os.remove(socket_path)
+        else:
+            raise RuntimeError('an ECU server is already listening on ' + socket_path)
+        finally:
+            probe.close()
+    elif not os.path.exists(os.path.dirname(os.path.abspath(socket_path))):
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    previous_umask = os.umask(0o177)
+    try:
+        server = EcuServer(socket_path, executor, stop_event)
+    finally:
+        os.umask(previous_umask)
+    server_thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.2}, daemon=True)
+    server_thread.start()
+    printer('Serving on ' + socket_path + ' with {} workers'.format(workers))
+
+    try:
+        stop_event.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+        executor.shutdown(wait=True)
+        duration_cache.flush()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def submit_jobs(requests, socket_path=None, on_event=None):
+    """
+    Sends job requests to a serve mode server and waits for them all to finish
+
+    on_event is called with every event the server sends back
+    returns the list of result and error events, one per request, in the order they finished
+    """
+
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    outcomes = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(b''.join((json.dumps(request) + '\n').encode('utf-8') for request in requests))
+        # closing our side tells the server no more jobs are coming, it closes its side once they're done
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('rb') as replies:
+            for line in replies:
+                event = json.loads(line.decode('utf-8'))
+                if on_event is not None:
+                    on_event(event)
+                if event['event'] in ('result', 'error'):
+                    outcomes.append(event)
+    return outcomes
+
+
+def print_server_event(event, printer=print):
+    """Prints a serve mode event the way the client command shows it"""
+
+    label = '[' + str(event.get('id')) + '] ' if event.get('id') is not None else ''
+    if event['event'] == 'step':
+        printer(label + event['step'] + ' ' + event['status'])
+    elif event['event'] == 'result':
+        printer(label + ('done' if event['ok'] else 'FAILED'))
+        for step, error in sorted(event['errors'].items()):
+            printer(label + '  ' + step + ': ' + error)
+    elif event['event'] == 'error':
+        printer(label + 'FAILED: ' + event['error'])
+    else:
+        printer(label + event['event'])
+
+
+class JobQueue(object):
+    """
+    Work queue of album and track jobs in an SQLite database that workers on any host sharing its directory claim from
+
+    a claimed job is leased to its worker for lease_seconds and the worker keeps extending the lease with heartbeats
+    while it runs the job, a job whose lease runs out is presumed lost with its worker and handed to the next worker
+    that asks, a job is tried up to its max_attempts times before it counts as failed
+    every claim is a single BEGIN IMMEDIATE transaction, so two workers never claim the same job, the database stays
+    in rollback journal mode since WAL needs shared memory that network filesystems don't provide
+    clock is only replaceable for testing
+    """
+
+    def __init__(self, queue_path, clock=time.time):
+
+        queue_directory = os.path.dirname(os.path.abspath(queue_path))
+        if not os.path.exists(queue_directory):
+            os.makedirs(queue_directory, exist_ok=True)
+        self.queue_path = queue_path
+        self.clock = clock
+        self.connection = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(QUEUE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Holds the database's write lock for the block, so reading and updating a job can't interleave"""
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def enqueue(self, kind, audio_file_path, tracklist_path=None, track=None, params=None,
+                max_attempts=QUEUE_MAX_ATTEMPTS):
+        """
+        Adds a job, kind is 'album' or 'track', track is the number of the track a track job splits
+
+        returns the job id, or None if the same job is already waiting or running
+        """
+
+        audio_file_path = os.path.abspath(audio_file_path)
+        if tracklist_path is not None:
+            tracklist_path = os.path.abspath(tracklist_path)
+        with self.transaction() as connection:
+            if connection.execute("SELECT 1 FROM jobs WHERE kind = ? AND audio = ? AND track IS ? "
+                                  "AND state IN ('pending', 'leased')", (kind, audio_file_path, track)).fetchone():
+                return None
+            return connection.execute(
+                'INSERT INTO jobs (kind, audio, tracklist, track, params, max_attempts, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, audio_file_path, tracklist_path, track, json.dumps(params or {}), max_attempts,
+                 self.clock())).lastrowid
+
+    def claim(self, worker, lease_seconds=QUEUE_LEASE_SECONDS):
+        """
+        Leases the oldest job that is pending or whose lease expired to worker, returns it as a dict or None
+
+        expired jobs that have used up their attempts are failed instead of handed out again
+        """
+
+        now = self.clock()
+        with self.transaction() as connection:
+            connection.execute("UPDATE jobs SET state = 'failed', finished = ?, "
+                               "error = coalesce(error || '; ', '') || 'lease expired on ' || worker "
+                               "WHERE state = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                               (now, now))
+            job = connection.execute("SELECT * FROM jobs WHERE state = 'pending' OR "
+                                     "(state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                                     (now,)).fetchone()
+            if job is None:
+                return None
+            connection.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, "
+                               "attempts = attempts + 1 WHERE id = ?", (worker, now + lease_seconds, job['id']))
+        job = dict(job)
+        job['params'] = json.loads(job['params'])
+        job['worker'] = worker
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_id, worker, lease_seconds=QUEUE_LEASE_SECONDS):
+        """Extends worker's lease on a job, returns False if the lease was lost to another worker"""
+
+        with self.transaction() as connection:
+            return connection.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? "
+                                      "AND state = 'leased'",
+                                      (self.clock() + lease_seconds, job_id, worker)).rowcount == 1
+
+    def complete(self, job_id, worker, result=None):
+        """Marks a job done, returns False if worker no longer holds its lease and the result was dropped"""
+
+        with self.transaction() as connection:
+            return connection.execute("UPDATE jobs SET state = 'done', result = ?, finished = ? "
+                                      "WHERE id = ? AND worker = ? AND state = 'leased'",
+                                      (json.dumps(result), self.clock(), job_id, worker)).rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """Records a failed attempt, the job goes back to pending until it has used up its attempts"""
+
+        with self.transaction() as connection:
+            return connection.execute("UPDATE jobs SET error = ?, worker = NULL, lease_expires = NULL, "
+                                      "state = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                                      "finished = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END "
+                                      "WHERE id = ? AND worker = ? AND state = 'leased'",
+                                      (str(error), self.clock(), job_id, worker)).rowcount == 1
+
+    def counts(self):
+        """Returns a dict of state to the number of jobs in it"""
+
+        return dict((row[0], row[1]) for row in
+                    self.connection.execute('SELECT state, count(*) FROM jobs GROUP BY state'))
+
+    def jobs(self, state=None):
+        """Returns every job, or every job in state, as dicts in the order they were queued"""
+
+        if state is None:
+            rows = self.connection.execute('SELECT * FROM jobs ORDER BY id')
+        else:
+            rows = self.connection.execute('SELECT * FROM jobs WHERE state = ? ORDER BY id', (state,))
+        return [dict(row) for row in rows]
+
+
+def enqueue_albums(queue, albums, split=True, per_track=False, jobs=1, engine='auto',
+                   max_attempts=QUEUE_MAX_ATTEMPTS, printer=print):
+    """
+    Queue mode coordinator, queues a job for every (audio_file_path, tracklist_path) in albums
+
+    an album job writes the cue file and splits the tracks on one worker, with per_track the coordinator writes
+    the cue file and probes the album itself, then queues a job per track so an album's tracks spread over workers
+    jobs and engine are passed on to the workers' split_tracks, returns the number of jobs queued
+    """
+
+    queued = 0
+    for audio_file_path, tracklist_path in albums:
+        params = {'split': split, 'jobs': jobs, 'engine': engine}
+        if not per_track or not split:
+            queued += queue.enqueue('album', audio_file_path, tracklist_path, params=params,
+                                    max_attempts=max_attempts) is not None
+            continue
+
+        try:
+            working_album = Album(audio_file_path, tracklist_path)
+            working_album.album_performer = 'Various Artists'
+            write_cue(working_album, working_album.album_title + '.cue', printer=silent_printer)
+            params['duration'] = working_album.total_duration_seconds
+            tracks = working_album.tracklist_data
+        except Exception as e:
+            printer('FAILED ' + audio_file_path + ': ' + str(e))
+            continue
+        for track in tracks:
+            queued += queue.enqueue('track', audio_file_path, tracklist_path, track=track.number, params=params,
+                                    max_attempts=max_attempts) is not None
+
+    printer('Queued {} jobs in {}'.format(queued, queue.queue_path))
+    return queued
+
+
+def run_queue_job(job, staging_directory):
+    """
+    Runs a single claimed queue job, writing everything into staging_directory rather than beside the audio
+
+    returns a tuple of (result as a dict of json types, list of (staged path, final path)) for
+    publish_queue_outputs to move into place once the worker knows it still holds the job's lease,
+    so a worker that lost its lease never overwrites the output of the worker the job went to next
+    raises if the job failed
+    a track job splits its one track, album jobs split every track afresh since the incremental split manifest
+    lives in the album's split directory, which is only written to on publishing
+    """
+
+    params = job['params']
+    working_album = Album(job['audio'], job['tracklist'], total_duration_seconds=params.get('duration'))
+    final_directory = working_album.audio_file_directory
+    working_album.audio_file_directory = staging_directory
+
+    if job['kind'] == 'album':
+        working_album.album_performer = 'Various Artists'
+        cue_path = write_cue(working_album, working_album.album_title + '.cue', printer=silent_printer)
+        outputs = [(cue_path, final_directory + '/' + os.path.basename(cue_path))]
+        if params.get('split', True):
+            track_paths = split_tracks(working_album, jobs=params.get('jobs', 1), engine=params.get('engine', 'auto'),
+                                       printer=silent_printer, incremental=False)
+            outputs += [(track_path, final_directory + '/split/' + os.path.basename(track_path))
+                        for track_path in track_paths]
+        return {'audio': job['audio'], 'outputs': [final_path for staged_path, final_path in outputs]}, outputs
+
+    if job['kind'] != 'track':
+        raise ValueError('unknown job kind: ' + str(job['kind']))
+    tracks = [track for track in working_album.tracklist_data if track.number == job['track']]
+    if not tracks:
+        raise ValueError('track ' + str(job['track']) + ' is no longer in the tracklist of ' + job['audio'])
+    engine = resolve_split_engine(working_album, params.get('engine', 'auto'))
+    if engine == 'segment':
+        # a segment split reads the whole file, a single track only needs its own stretch of it
+        engine = 'per-track'
+    track_album = copy.copy(working_album)
+    track_album.tracklist_data = tracks
+    run_split_engine(track_album, staging_directory, 1, engine, printer=silent_printer)
+    track_path = staging_directory + '/' + get_track_filename(working_album, tracks[0])
+    if not os.path.exists(track_path):
+        raise RuntimeError('no output was written for track ' + str(job['track']) + ' of ' + job['audio'])
+    final_path = final_directory + '/split/' + os.path.basename(track_path)
+    return {'audio': job['audio'], 'track': job['track'], 'track_path': final_path}, [(track_path, final_path)]
+
+
+def publish_queue_outputs(outputs):
+    """Moves the staged outputs of a queue job into place, each one replaces its final path in a single rename"""
+
+    for staged_path, final_path in outputs:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(staged_path, final_path)
+
+
+def work_queue(queue_path, worker=None, lease_seconds=QUEUE_LEASE_SECONDS, poll_interval=QUEUE_POLL_INTERVAL,
+               exit_when_empty=False, stop_event=None, printer=print):
+    """
+    Queue mode worker, claims and runs jobs from the queue at queue_path until stop_event is set
+
+    worker names this worker in the queue, by default host:pid, each job's lease is renewed from a background thread
+    every third of lease_seconds while the job runs, when the queue has nothing to claim it is polled again
+    every poll_interval seconds, or with exit_when_empty the worker returns once no job is pending or leased
+    a job runs in a staging directory beside its audio file, its output is only moved into place if the lease
+    is confirmed once more after the job finished, if the lease was lost, or couldn't be renewed, the output is
+    discarded since the job has been handed to another worker
+    returns a tuple of (number of jobs done, number of jobs failed) by this worker
+    """
+
+    if worker is None:
+        worker = socket.gethostname() + ':' + str(os.getpid())
+    if stop_event is None:
+        stop_event = threading.Event()
+    queue = JobQueue(queue_path)
+    done = 0
+    failed = 0
+
+    try:
+        while not stop_event.is_set():
+            job = queue.claim(worker, lease_seconds)
+            if job is None:
+                counts = queue.counts()
+                if exit_when_empty and not counts.get('pending') and not counts.get('leased'):
+                    break
+                stop_event.wait(poll_interval)
+                continue
+
+            label = job['audio'] + (' track ' + job['track'] if job['track'] is not None else '')
+            finished = threading.Event()
+            lost = threading.Event()
+
+            def keep_leased(job_id=job['id'], finished=finished, lost=lost):
+                # the heartbeats have their own connection, sqlite connections aren't shared between threads,
+                # a heartbeat that fails, say on a filesystem that stays locked, counts as losing the lease
+                try:
+                    heartbeat_queue = JobQueue(queue_path)
+                    try:
+                        while not finished.wait(lease_seconds / 3):
+                            if not heartbeat_queue.heartbeat(job_id, worker, lease_seconds):
+                                lost.set()
+                                return
+                    finally:
+                        heartbeat_queue.close()
+                except Exception:
+                    lost.set()
+
+            heartbeat_thread = threading.Thread(target=keep_leased, daemon=True)
+            heartbeat_thread.start()
+            staging_directory = None
+            try:
+                try:
+                    # a missing or read only audio directory fails the job like any other error
+                    staging_directory = tempfile.mkdtemp(prefix='.ecu-job-', dir=os.path.dirname(job['audio']))
+                    result, outputs = run_queue_job(job, staging_directory)
+                finally:
+                    finished.set()
+                    heartbeat_thread.join()
+            except Exception as e:
+                queue.fail(job['id'], worker, e)
+                failed += 1
+                printer('FAILED ' + label + ' (attempt {} of {}): '.format(job['attempts'], job['max_attempts']) +
+                        str(e))
+                continue
+            else:
+                try:
+                    held = not lost.is_set() and queue.heartbeat(job['id'], worker, lease_seconds)
+                except sqlite3.Error:
+                    held = False
+                if not held:
+                    printer('Lost the lease on ' + label + ', discarding its output')
+                    continue
+                publish_queue_outputs(outputs)
+                if queue.complete(job['id'], worker, result):
+                    done += 1
+                    printer('Done ' + label)
+            finally:
+                if staging_directory is not None:
+                    shutil.rmtree(staging_directory, ignore_errors=True)
+    finally:
+        queue.close()
+
+    return done, failed
+
+
+def add_engine_argument(parser):
+    """Adds the -e/--engine option shared by every command that splits tracks"""
+
+    parser.add_argument('-e', '--engine', choices=SPLIT_ENGINES, default=SPLIT_ENGINES[0],
+                        help='native copies WAVE/AIFF/mp3 tracks without ffmpeg, segment reads the audio once, '
+                             'per-track runs ffmpeg for every track, auto picks the fastest that works')
+
+
+def parse_them_args(args):
+    """Separate function to test argparse configuration"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('audio', help='path to audio file to be processed')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='extra user prompts appear')
+    parser.add_argument('-j', '--jobs', type=int, help='number of tracks split at once, defaults to core count')
+    add_engine_argument(parser)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe the audio file again')
+    parser.add_argument('--metrics', help='write per stage and per track timings to this json file')
+    parser.add_argument('--profile', help='dump cProfile stats to this file and tracemalloc stats beside it')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_batch_args(args):
+    """argparse configuration of the batch command, ecu.py batch path"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py batch')
+    parser.add_argument('path', help='directory tree of albums or a csv list file of audio[,tracklist] paths')
+    parser.add_argument('-w', '--workers', type=int, help='number of albums processed at once, defaults to core count')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of tracks split at once per album')
+    add_engine_argument(parser)
+    parser.add_argument('--no-split', dest='split', action='store_false', help='only write cue files')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe every audio file again')
+    parser.add_argument('--catalog', type=str, help='catalog database to record albums in and skip processed ones')
+    parser.add_argument('--reprocess', action='store_true', help='process albums the catalog holds as processed')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_catalog_args(args):
+    """argparse configuration of the catalog command, ecu.py catalog import path or ecu.py catalog find"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py catalog')
+    parser.add_argument('--catalog', type=str, help='catalog database, defaults to catalog.sqlite in the cache')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    import_parser = subparsers.add_parser('import', help='record every album under a path without processing it')
+    import_parser.add_argument('path', help='directory tree of albums or a csv list file of audio[,tracklist] paths')
+    import_parser.add_argument('-w', '--workers', type=int, help='number of albums probed at once')
+    import_parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe every audio file')
+    find_parser = subparsers.add_parser('find', help='list recorded tracks')
+    find_parser.add_argument('--artist', type=str, help='whole artist name, ignoring case')
+    find_parser.add_argument('--title', type=str, help='whole track title, ignoring case')
+    find_parser.add_argument('--output', type=str, help='path of a split track')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_queue_args(args):
+    """argparse configuration of the queue command, ecu.py queue -q queue enqueue path, work or status"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py queue')
+    parser.add_argument('-q', '--queue', required=True, help='queue database, on a filesystem every host shares')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    enqueue_parser = subparsers.add_parser('enqueue', help='queue a job for every album under a path')
+    enqueue_parser.add_argument('path', help='audio file, directory tree of albums or a csv list file of '
+                                             'audio[,tracklist] paths')
+    enqueue_parser.add_argument('-t', '--tracklist', type=str,
+                                help='path to tracklist csv file, only for a single audio file')
+    enqueue_parser.add_argument('--per-track', action='store_true', help='queue a job per track instead of per album')
+    enqueue_parser.add_argument('--no-split', dest='split', action='store_false', help='only write cue files')
+    enqueue_parser.add_argument('-j', '--jobs', type=int, default=1, help='number of tracks split at once per album')
+    add_engine_argument(enqueue_parser)
+    enqueue_parser.add_argument('--attempts', type=int, default=QUEUE_MAX_ATTEMPTS,
+                                help='times a job is tried before it counts as failed')
+    work_parser = subparsers.add_parser('work', help='claim and run jobs')
+    work_parser.add_argument('--worker', type=str, help='name of this worker in the queue, defaults to host:pid')
+    work_parser.add_argument('--lease', type=float, default=QUEUE_LEASE_SECONDS,
+                             help='seconds without a heartbeat before a job is handed to another worker')
+    work_parser.add_argument('--exit-when-empty', action='store_true', help='stop once no job is pending or running')
+    subparsers.add_parser('status', help='count the jobs in each state and list the failed ones')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_serve_args(args):
+    """argparse configuration of the serve command, ecu.py serve"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py serve')
+    parser.add_argument('--socket', help='unix socket to listen on, defaults to ecu.sock in the cache directory')
+    parser.add_argument('-w', '--workers', type=int, help='number of albums processed at once, defaults to core count')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_client_args(args):
+    """argparse configuration of the client command, ecu.py client audio [audio ...]"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py client')
+    parser.add_argument('audio', nargs='+', help='paths to audio files to be processed by the server')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file, only for a single audio file')
+    parser.add_argument('--socket', help='unix socket of the server, defaults to ecu.sock in the cache directory')
+    parser.add_argument('-p', '--performer', default='Various Artists', help='album performer written to the cue')
+    parser.add_argument('-j', '--jobs', type=int, help='number of tracks split at once, defaults to core count')
+    add_engine_argument(parser)
+    parser.add_argument('--no-cue', dest='cue', action='store_false', help='only split the tracks')
+    parser.add_argument('--no-split', dest='split', action='store_false', help='only write cue files')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe the audio files again')
+    pargs = parser.parse_args(args)
+    if pargs.tracklist and len(pargs.audio) > 1:
+        parser.error('--tracklist can only be used with a single audio file')
+    return pargs
+
+
+def parse_transcode_args(args):
+    """argparse configuration of the transcode command, ecu.py transcode audio -f format [format ...]"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py transcode')
+    parser.add_argument('audio', help='path to audio file to be processed')
+    parser.add_argument('-f', '--formats', nargs='+', required=True, choices=sorted(TRANSCODE_PRESETS),
+                        help='formats every track is encoded to')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file')
+    parser.add_argument('-j', '--jobs', type=int, help='number of ffmpeg instances at once, defaults to core count')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe the audio file again')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_archive_args(args):
+    """argparse configuration of the archive command, ecu.py archive audio"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py archive')
+    parser.add_argument('audio', help='path to audio file to be processed')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file')
+    parser.add_argument('-o', '--output', type=str, default='-', help='archive file to write, - for stdout')
+    parser.add_argument('-f', '--format', choices=ARCHIVE_FORMATS,
+                        help='archive format, defaults to tar for a .tar output and zip otherwise')
+    parser.add_argument('--cue', action='store_true', help='add the cue sheet to the archive')
+    parser.add_argument('-p', '--performer', default='Various Artists', help='album performer of the cue sheet')
+    parser.add_argument('--engine', choices=ARCHIVE_ENGINES, default='auto',
+                        help='how tracks are cut, native copies them without ffmpeg where the format allows')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='probe the audio file again')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_verify_args(args):
+    """argparse configuration of the verify command, ecu.py verify path"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py verify')
+    parser.add_argument('path', help='audio file, directory tree of albums or a csv list file of audio[,tracklist] '
+                                     'paths whose split tracks are checked')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file, only for a single audio file')
+    parser.add_argument('-j', '--jobs', type=int, help='number of tracks checked at once, defaults to 4 per core')
+    parser.add_argument('--tolerance', type=float, default=VERIFY_TOLERANCE,
+                        help='seconds a track\'s duration may be off its tracklist length')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_index_args(args):
+    """argparse configuration of the index command, ecu.py index audio"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py index')
+    parser.add_argument('audio', help='path to audio file whose tracklist is indexed')
+    parser.add_argument('-t', '--tracklist', type=str, help='path to tracklist csv file')
+    parser.add_argument('-o', '--output', type=str, help='index file to write, defaults to the audio path with .ecut')
+    parser.add_argument('--at', nargs='+', default=[], metavar='TIME',
+                        help='seconds or HH:MM:SS timestamps to print the playing track of')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_detect_args(args):
+    """argparse configuration of the detect command, ecu.py detect audio"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py detect')
+    parser.add_argument('audio', help='path to audio file to propose a tracklist for')
+    parser.add_argument('-o', '--output', help='tracklist csv file to write, defaults to stdout')
+    parser.add_argument('--threshold', type=float, default=DETECT_THRESHOLD_DB,
+                        help='level in dBFS below which audio counts as silence')
+    parser.add_argument('--min-silence', type=float, default=DETECT_MIN_SILENCE,
+                        help='seconds of silence that separate two tracks')
+    parser.add_argument('--min-track-length', type=float, default=DETECT_MIN_TRACK_LENGTH,
+                        help='seconds a track lasts at least, shorter gaps are ignored')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+def parse_watch_args(args):
+    """argparse configuration of the watch command, ecu.py watch directory [directory ...]"""
+
+    parser = argparse.ArgumentParser(prog='ecu.py watch')
+    parser.add_argument('directories', nargs='+', help='drop directories to watch for new albums')
+    parser.add_argument('-w', '--workers', type=int, help='number of albums processed at once, defaults to core count')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of tracks split at once per album')
+    add_engine_argument(parser)
+    parser.add_argument('--no-split', dest='split', action='store_false', help='only write cue files')
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help='seconds an album\'s files must stay unchanged before it is processed')
+    parser.add_argument('--poll', type=float, default=2.0, help='seconds between scans when inotify is unavailable')
+    parser.add_argument('--max-in-flight', type=int, help='albums handed to the workers at once, defaults to twice '
+                                                          'the number of workers')
+    parser.add_argument('--state', help='queue state file, defaults to watch-queue.json in the cache directory')
+    pargs = parser.parse_args(args)
+    return pargs
+
+
+if __name__ == '__main__':
+    # print(sys.argv)
+    if sys.argv[1:2] == ['batch']:
+        parsed_args = parse_batch_args(sys.argv[2:])
+        batch_failed = batch_generate(parsed_args.path, workers=parsed_args.workers, split=parsed_args.split,
+                                      jobs=parsed_args.jobs, engine=parsed_args.engine,
+                                      use_cache=parsed_args.use_cache, catalog_path=parsed_args.catalog,
+                                      reprocess=parsed_args.reprocess)[1]
+        sys.exit(1 if batch_failed else 0)
+    elif sys.argv[1:2] == ['catalog']:
+        parsed_args = parse_catalog_args(sys.argv[2:])
+        library_catalog = Catalog(parsed_args.catalog)
+        if parsed_args.action == 'import':
+            import_albums(parsed_args.path, library_catalog, workers=parsed_args.workers,
+                          use_cache=parsed_args.use_cache)
+        else:
+            for found_track in library_catalog.find_tracks(parsed_args.artist, parsed_args.title, parsed_args.output):
+                print('\t'.join([found_track['album'], found_track['number'], found_track['artist'],
+                                 found_track['title'], get_hms(found_track['start']),
+                                 found_track['output_path'] or '']))
+        library_catalog.close()
+    elif sys.argv[1:2] == ['queue']:
+        parsed_args = parse_queue_args(sys.argv[2:])
+        if parsed_args.action == 'work':
+            try:
+                queue_failed = work_queue(parsed_args.queue, worker=parsed_args.worker, lease_seconds=parsed_args.lease,
+                                          exit_when_empty=parsed_args.exit_when_empty)[1]
+            except KeyboardInterrupt:
+                queue_failed = 0
+            sys.exit(1 if queue_failed else 0)
+        work_queue_db = JobQueue(parsed_args.queue)
+        if parsed_args.action == 'enqueue':
+            if os.path.splitext(parsed_args.path)[1].lower() in AUDIO_EXTENSIONS:
+                queue_targets = [(parsed_args.path, parsed_args.tracklist)]
+            else:
+                queue_targets = discover_albums(parsed_args.path)
+            enqueue_albums(work_queue_db, queue_targets, split=parsed_args.split, per_track=parsed_args.per_track,
+                           jobs=parsed_args.jobs, engine=parsed_args.engine, max_attempts=parsed_args.attempts)
+        else:
+            print(', '.join('{} {}'.format(count, state) for state, count in sorted(work_queue_db.counts().items())))
+            for failed_job in work_queue_db.jobs('failed'):
+                print('FAILED ' + failed_job['audio'] + (' track ' + failed_job['track'] if failed_job['track'] else '')
+                      + ': ' + str(failed_job['error']))
+        work_queue_db.close()
+    elif sys.argv[1:2] == ['serve']:
+        parsed_args = parse_serve_args(sys.argv[2:])
+        try:
+            serve(parsed_args.socket, workers=parsed_args.workers)
+        except KeyboardInterrupt:
+            pass
+    elif sys.argv[1:2] == ['client']:
+        parsed_args = parse_client_args(sys.argv[2:])
+        # the server has its own working directory, so every path is sent absolute
+        client_requests = [{'id': str(number), 'audio': os.path.abspath(audio_file_path),
+                            'tracklist': os.path.abspath(parsed_args.tracklist) if parsed_args.tracklist else None,
+                            'performer': parsed_args.performer, 'cue': parsed_args.cue, 'split': parsed_args.split,
+                            'jobs': parsed_args.jobs, 'engine': parsed_args.engine, 'use_cache': parsed_args.use_cache}
+                           for number, audio_file_path in enumerate(parsed_args.audio, 1)]
+        client_outcomes = submit_jobs(client_requests, parsed_args.socket, on_event=print_server_event)
+        sys.exit(0 if all(outcome.get('ok') for outcome in client_outcomes) else 1)
+    elif sys.argv[1:2] == ['transcode']:
+        parsed_args = parse_transcode_args(sys.argv[2:])
+        transcode_tracks(Album(parsed_args.audio, parsed_args.tracklist, use_cache=parsed_args.use_cache),
+                         parsed_args.formats, jobs=parsed_args.jobs)
+    elif sys.argv[1:2] == ['archive']:
+        parsed_args = parse_archive_args(sys.argv[2:])
+        archive_album = Album(parsed_args.audio, parsed_args.tracklist, use_cache=parsed_args.use_cache)
+        archive_album.album_performer = parsed_args.performer
+        archive_format = parsed_args.format or ('tar' if parsed_args.output.endswith('.tar') else 'zip')
+        archive_args = (archive_format, parsed_args.cue, parsed_args.engine)
+        try:
+            if parsed_args.output == '-':
+                archive_tracks(archive_album, sys.stdout.buffer, *archive_args)
+                sys.stdout.buffer.flush()
+            else:
+                write_archive(archive_album, parsed_args.output, *archive_args)
+        except Exception as archive_error:
+            # the piped archive was left truncated so whatever reads it fails too
+            print('Archive incomplete: ' + str(archive_error), file=sys.stderr)
+            sys.exit(1)
+    elif sys.argv[1:2] == ['verify']:
+        parsed_args = parse_verify_args(sys.argv[2:])
+        if os.path.splitext(parsed_args.path)[1].lower() in AUDIO_EXTENSIONS:
+            verify_targets = [(parsed_args.path, parsed_args.tracklist)]
+        else:
+            verify_targets = discover_albums(parsed_args.path)
+        verify_failed = verify_albums(verify_targets, jobs=parsed_args.jobs, tolerance=parsed_args.tolerance)[1]
+        sys.exit(1 if verify_failed else 0)
+    elif sys.argv[1:2] == ['index']:
+        parsed_args = parse_index_args(sys.argv[2:])
+        track_index = TrackIndex.from_album(Album(parsed_args.audio, parsed_args.tracklist))
+        track_index.save(parsed_args.output or os.path.splitext(parsed_args.audio)[0] + '.ecut')
+        for timestamp in parsed_args.at:
+            try:
+                seconds = float(timestamp)
+            except ValueError:
+                seconds = get_seconds(timestamp)
+            playing = track_index.track_at(seconds)
+            print(timestamp + '\t' + ('-' if playing is None else playing.number + ' ' + playing.artist + ' - ' +
+                                      playing.title))
+    elif sys.argv[1:2] == ['detect']:
+        parsed_args = parse_detect_args(sys.argv[2:])
+        detect_args = (parsed_args.threshold, parsed_args.min_silence, parsed_args.min_track_length)
+        if parsed_args.output:
+            with open(parsed_args.output, 'w', newline='') as output_file:
+                detect_tracklist(parsed_args.audio, output_file, *detect_args)
+        else:
+            detect_tracklist(parsed_args.audio, sys.stdout, *detect_args)
+    elif sys.argv[1:2] == ['watch']:
+        parsed_args = parse_watch_args(sys.argv[2:])
+        try:
+            watch(parsed_args.directories, workers=parsed_args.workers, split=parsed_args.split,
+                  jobs=parsed_args.jobs, engine=parsed_args.engine, settle=parsed_args.settle,
+                  poll_interval=parsed_args.poll, max_in_flight=parsed_args.max_in_flight,
+                  state_path=parsed_args.state)
+        except KeyboardInterrupt:
+            # albums in flight are still pending in the queue state and are picked up on the next start
+            pass
+    else:
+        parsed_args = parse_them_args(sys.argv[1:])
+        generate_args = (parsed_args.audio, parsed_args.tracklist, parsed_args.verbose, parsed_args.jobs,
+                         parsed_args.engine, parsed_args.use_cache)
+        if parsed_args.metrics:
+            metrics.enable()
+        try:
+            if parsed_args.profile:
+                run_profiled(parsed_args.profile, generate, *generate_args)
+            else:
+                generate(*generate_args)
+        finally:
+            if parsed_args.metrics:
+                metrics.write_report(parsed_args.metrics)